@@ -0,0 +1,97 @@
+"""Run the benchmarks without asv, storing results as JSON
+
+Usage::
+
+    python -m benchmarks [-k PATTERN] [--output FILE] [--compare FILE]
+
+Each result is the best time per call, in seconds, over several repeats.
+"""
+
+import argparse
+import datetime
+import inspect
+import itertools
+import json
+import platform
+import timeit
+
+import cssdecl
+
+from . import bench_resolve
+
+MODULES = [bench_resolve]
+
+
+def iter_benchmarks(pattern=None):
+    """Generate (name, function, params) for each benchmark to run"""
+    for module in MODULES:
+        module_name = module.__name__.rsplit('.', 1)[-1]
+        for cls_name, cls in sorted(vars(module).items()):
+            if not inspect.isclass(cls) or cls.__module__ != module.__name__:
+                continue
+            params = getattr(cls, 'params', [])
+            if params and not isinstance(params[0], list):
+                params = [params]
+            for method_name in sorted(vars(cls)):
+                if not method_name.startswith('time_'):
+                    continue
+                name = '%s.%s.%s' % (module_name, cls_name, method_name)
+                if pattern is not None and pattern not in name:
+                    continue
+                for combination in itertools.product(*params):
+                    yield name, cls, method_name, combination
+
+
+def run_benchmark(cls, method_name, params, repeat=3, min_time=.2):
+    benchmark = cls()
+    if hasattr(benchmark, 'setup'):
+        benchmark.setup(*params)
+    method = getattr(benchmark, method_name)
+    timer = timeit.Timer(lambda: method(*params))
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / .2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def format_key(name, params):
+    return '%s(%s)' % (name, ', '.join(repr(p) for p in params))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-k', dest='pattern',
+                        help='only run benchmarks whose names contain this')
+    parser.add_argument('--output', default='benchmarks-%s.json'
+                        % cssdecl.__version__,
+                        help='JSON file for results (default: %(default)s)')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+    results = {}
+    for name, cls, method_name, params in iter_benchmarks(args.pattern):
+        key = format_key(name, params)
+        seconds = run_benchmark(cls, method_name, params, repeat=args.repeat)
+        results[key] = seconds
+        line = '%-70s %10.2fus' % (key, seconds * 1e6)
+        if key in previous:
+            line += ' %6.2fx' % (previous[key] / seconds)
+        print(line)
+
+    with open(args.output, 'w') as f:
+        json.dump({'version': cssdecl.__version__,
+                   'python': platform.python_version(),
+                   'implementation': platform.python_implementation(),
+                   'machine': platform.machine(),
+                   'date': datetime.datetime.now().isoformat(),
+                   'results': results}, f, indent=1, sort_keys=True)
+    print('Results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
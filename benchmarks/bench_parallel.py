@@ -0,0 +1,42 @@
+"""Benchmark scaling of CSS22Resolver.resolve_many with worker processes
+
+Usage::
+
+    python -m benchmarks.bench_parallel [--n-styles N] [--n-cells N]
+"""
+
+import argparse
+import os
+import time
+
+from cssdecl import CSS22Resolver
+from benchmarks.corpus import make_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n-styles', type=int, default=20000)
+    parser.add_argument('--n-cells', type=int, default=100000)
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.n_styles, args.n_cells, skew=0)
+    resolver = CSS22Resolver()
+    print('%d cells, %d distinct styles, %d CPUs'
+          % (len(corpus), len(set(corpus)), os.cpu_count() or 1))
+    print('%6s %10s %10s' % ('n_jobs', 'seconds', 'speedup'))
+    baseline = None
+    for n_jobs in args.jobs:
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            resolver.resolve_many(corpus, n_jobs=n_jobs)
+            best = min(best, time.perf_counter() - start)
+        if baseline is None:
+            baseline = best
+        print('%6d %10.3f %10.2f' % (n_jobs, best, baseline / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Benchmarks of CSS22Resolver.resolve_string and batch resolution
+
+These follow the conventions of airspeed velocity (asv), and may also be
+run offline with ``python -m benchmarks``.
+"""
+
+import warnings
+
+from cssdecl import CSS22Resolver, CSSWarning
+
+from .corpus import make_corpus, make_styles
+
+SHORTHAND_VALUES = {
+    'border': '1px solid red',
+    'border-top': 'thick dashed rgb(10, 20, 30)',
+    'border-right': 'thin #abc',
+    'border-bottom': 'solid 2pt',
+    'border-left': 'medium double blue',
+    'border-color': 'red green blue',
+    'border-style': 'solid none',
+    'border-width': '1px 2px 3px 4px',
+    'margin': '1em 2pt',
+    'padding': '1mm 2mm 3mm',
+    'font': 'italic bold 12px/1.5 serif',
+    'background': 'url(a.png) no-repeat 0 50% #fff',
+}
+
+
+class SingleProperty(object):
+    params = ['color: red', 'font-weight: bold', 'font-family: serif',
+              'text-align: right', 'background-color: #ff0000']
+    param_names = ['declaration']
+
+    def setup(self, declaration):
+        self.resolver = CSS22Resolver()
+
+    def time_resolve_string(self, declaration):
+        self.resolver.resolve_string(declaration)
+
+
+class Shorthand(object):
+    params = sorted(CSS22Resolver._get_expanders())
+    param_names = ['shorthand']
+
+    def setup(self, shorthand):
+        self.resolver = CSS22Resolver()
+        self.declaration = '%s: %s' % (shorthand,
+                                       SHORTHAND_VALUES.get(shorthand, '1pt'))
+        # time expansion, not the warning for an invalid value
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CSSWarning)
+            self.resolver.resolve_string(self.declaration)
+
+    def time_resolve_string(self, shorthand):
+        self.resolver.resolve_string(self.declaration)
+
+
+class Sizes(object):
+    params = [['pt', 'px', 'em', 'q', '%', 'keyword'],
+              [False, True]]
+    param_names = ['unit', 'inherited']
+
+    def setup(self, unit, inherited):
+        self.resolver = CSS22Resolver()
+        # keywords and % are not supported for margin and padding
+        side_unit = 'pt' if unit in ('keyword', '%') else unit
+        sides = ' '.join('%d%s' % (i, side_unit) for i in range(1, 5))
+        if unit == 'keyword':
+            font_size = 'large'
+            widths = 'thin medium thick thin'
+        else:
+            font_size = '1.5' + unit
+            widths = sides
+        self.declarations = ('font-size: %s; border-width: %s; '
+                             'margin: %s; padding: %s'
+                             % (font_size, widths, sides, sides))
+        self.inherited = {'font-size': '15pt'} if inherited else None
+
+    def time_resolve_string(self, unit, inherited):
+        self.resolver.resolve_string(self.declarations, self.inherited)
+
+
+class DeepInherited(object):
+    params = [10, 100, 1000]
+    param_names = ['n_inherited']
+
+    def setup(self, n_inherited):
+        self.resolver = CSS22Resolver()
+        self.inherited = dict(('x-prop-%d' % i, 'value-%d' % i)
+                              for i in range(n_inherited - 2))
+        self.inherited.update({'font-size': '12pt', 'color': 'red'})
+
+    def time_resolve_string(self, n_inherited):
+        self.resolver.resolve_string('font-size: 2em; color: inherit; '
+                                     'margin-top: 1em', self.inherited)
+
+
+class Invalid(object):
+    params = ['font-size: blah', 'margin: 1pt 1pt 1pt 1pt 1pt',
+              'hello-world; color: red', 'border-width: 10']
+    param_names = ['declaration']
+
+    def setup(self, declaration):
+        self.resolver = CSS22Resolver()
+
+    def time_resolve_string(self, declaration):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.resolver.resolve_string(declaration)
+
+
+class Corpus(object):
+    """Resolving every cell of a synthetic table"""
+
+    params = [[10, 300], [0., 1.2]]
+    param_names = ['n_styles', 'skew']
+    n_cells = 5000
+
+    def setup(self, n_styles, skew):
+        self.corpus = make_corpus(n_styles, self.n_cells, skew=skew)
+
+    def time_resolve_string_loop(self, n_styles, skew):
+        resolve = CSS22Resolver().resolve_string
+        for declarations in self.corpus:
+            resolve(declarations)
+
+    def time_resolve_string_cached(self, n_styles, skew):
+        resolve = CSS22Resolver(cache_size=n_styles).resolve_string
+        for declarations in self.corpus:
+            resolve(declarations)
+
+    def time_resolve_many(self, n_styles, skew):
+        CSS22Resolver().resolve_many(self.corpus)
+
+
+class DistinctStyles(object):
+    """Resolving many distinct styles, where caching cannot help"""
+
+    params = [[False, True]]
+    param_names = ['typed']
+
+    def setup(self, typed):
+        self.styles = make_styles(500)
+
+    def time_resolve_many(self, typed):
+        CSS22Resolver().resolve_many(self.styles, typed=typed)
@@ -0,0 +1,101 @@
+"""Benchmark throughput of a CSS22Resolver shared between threads
+
+On a free-threaded build of Python, each measurement is made both with and
+without the GIL, by rerunning this script with ``-X gil=1`` and ``-X gil=0``.
+
+Usage::
+
+    python -m benchmarks.bench_threads [--n-styles N] [--n-cells N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import sysconfig
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cssdecl import CSS22Resolver
+from benchmarks.corpus import make_corpus
+
+
+def resolve_all(resolver, corpus, n_threads):
+    """Resolve each cell with resolve_string, splitting cells among threads
+    """
+    chunks = [corpus[i::n_threads] for i in range(n_threads)]
+
+    def resolve_chunk(chunk):
+        resolve = resolver.resolve_string
+        for declarations_str in chunk:
+            resolve(declarations_str)
+
+    with ThreadPoolExecutor(n_threads) as executor:
+        list(executor.map(resolve_chunk, chunks))
+
+
+def run(args):
+    gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+    corpus = make_corpus(args.n_styles, args.n_cells, skew=args.skew)
+    print('GIL %s: %d cells, %d distinct styles, %d CPUs'
+          % ('enabled' if gil_enabled else 'disabled', len(corpus),
+             len(set(corpus)), os.cpu_count() or 1))
+    print('%8s %14s %14s %10s' % ('threads', 'mode', 'cells/second',
+                                  'speedup'))
+    for mode in ['uncached', 'cached', 'resolve_many']:
+        baseline = None
+        for n_threads in args.threads:
+            best = float('inf')
+            for _ in range(args.repeat):
+                # a fresh resolver, so that the cache starts cold
+                resolver = CSS22Resolver(
+                    cache_size=args.cache_size if mode == 'cached' else 0)
+                start = time.perf_counter()
+                if mode == 'resolve_many':
+                    resolver.resolve_many(corpus, n_jobs=n_threads,
+                                          backend='thread')
+                else:
+                    resolve_all(resolver, corpus, n_threads)
+                best = min(best, time.perf_counter() - start)
+            if baseline is None:
+                baseline = best
+            print('%8d %14s %14.0f %10.2f' % (n_threads, mode,
+                                              len(corpus) / best,
+                                              baseline / best))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n-styles', type=int, default=2000)
+    parser.add_argument('--n-cells', type=int, default=20000)
+    parser.add_argument('--skew', type=float, default=1.)
+    parser.add_argument('--cache-size', type=int, default=4096)
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--gil', choices=['both', 'current'], default='both',
+                        help='On a free-threaded build, whether to measure '
+                             'with and without the GIL, or only as the '
+                             'interpreter is currently running')
+    args = parser.parse_args()
+
+    if args.gil == 'current' or not sysconfig.get_config_var(
+            'Py_GIL_DISABLED'):
+        if args.gil == 'both':
+            print('Not a free-threaded build: measuring with the GIL only')
+        run(args)
+        return
+
+    argv = ['--n-styles', str(args.n_styles), '--n-cells', str(args.n_cells),
+            '--skew', str(args.skew), '--cache-size', str(args.cache_size),
+            '--repeat', str(args.repeat), '--threads']
+    argv.extend(str(n_threads) for n_threads in args.threads)
+    for gil in ['1', '0']:
+        subprocess.check_call([sys.executable, '-X', 'gil=' + gil, '-m',
+                               'benchmarks.bench_threads', '--gil=current']
+                              + argv)
+        print()
+
+
+if __name__ == '__main__':
+    main()
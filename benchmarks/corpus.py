@@ -0,0 +1,101 @@
+"""Seeded generators of synthetic CSS declaration corpora
+
+These imitate the per-cell styles produced by pandas' Styler: a few
+hundred distinct declaration blocks, some used far more than others.
+"""
+
+import random
+
+FONT_FAMILIES = ['serif', 'sans-serif', 'Arial, sans-serif', 'Calibri',
+                 'Times New Roman']
+BORDER_STYLES = ['solid', 'dashed', 'dotted', 'double', 'none']
+ALIGNMENTS = ['left', 'right', 'center', 'justify']
+SIZE_UNITS = ['pt', 'px', 'em', 'mm']
+FONT_SIZE_UNITS = SIZE_UNITS + ['%']
+
+
+def _hex_color(rng):
+    return '#%06x' % rng.randrange(0x1000000)
+
+
+def _color(rng):
+    return rng.choice([_hex_color(rng), _hex_color(rng)[:4],
+                       'rgb(%d, %d, %d)' % (rng.randrange(256),
+                                            rng.randrange(256),
+                                            rng.randrange(256)),
+                       rng.choice(['red', 'blue', 'black', 'white', 'grey',
+                                   'DarkGreen'])])
+
+
+def _size(rng, units=SIZE_UNITS):
+    unit = rng.choice(units)
+    if unit == '%':
+        return '%d%%' % rng.randint(50, 200)
+    return '%g%s' % (round(rng.uniform(0, 3 if unit == 'em' else 20), 1),
+                     unit)
+
+
+def make_style(rng):
+    """Generate a single declaration block"""
+    decls = ['background-color: %s' % _color(rng)]
+    if rng.random() < .7:
+        decls.append('color: %s' % _color(rng))
+    if rng.random() < .5:
+        decls.append('font-weight: %s' % rng.choice(['bold', 'normal']))
+    if rng.random() < .3:
+        decls.append('font-style: italic')
+    if rng.random() < .4:
+        decls.append('font-size: %s' % _size(rng, FONT_SIZE_UNITS))
+    if rng.random() < .3:
+        decls.append('font-family: %s' % rng.choice(FONT_FAMILIES))
+    if rng.random() < .5:
+        decls.append('text-align: %s' % rng.choice(ALIGNMENTS))
+    if rng.random() < .4:
+        side = rng.choice(['', '-top', '-right', '-bottom', '-left'])
+        decls.append('border%s: %s %s %s' % (
+            side, rng.choice(['thin', 'medium', 'thick', _size(rng, ['px'])]),
+            rng.choice(BORDER_STYLES), _color(rng)))
+    if rng.random() < .2:
+        decls.append('margin: %s' % ' '.join(_size(rng) for _ in
+                                             range(rng.randint(1, 4))))
+    if rng.random() < .2:
+        decls.append('padding: %s %s' % (_size(rng), _size(rng)))
+    rng.shuffle(decls)
+    return '; '.join(decls)
+
+
+def make_styles(n_styles, seed=0):
+    """Generate a list of distinct declaration blocks"""
+    rng = random.Random(seed)
+    styles = []
+    seen = set()
+    while len(styles) < n_styles:
+        style = make_style(rng)
+        if style not in seen:
+            seen.add(style)
+            styles.append(style)
+    return styles
+
+
+def make_corpus(n_styles=100, n_cells=10000, skew=1., seed=0):
+    """Generate declaration blocks for many cells
+
+    Parameters
+    ----------
+    n_styles : int
+        The number of distinct declaration blocks
+    n_cells : int
+        The number of blocks to generate
+    skew : float
+        The k-th most common style is used with frequency proportional to
+        ``1 / k ** skew``, so 0 makes all styles equally common.
+    seed : int
+
+    Returns
+    -------
+    corpus : list of str
+    """
+    styles = make_styles(n_styles, seed=seed)
+    rng = random.Random(seed)
+    weights = [1. / (rank ** skew) for rank in range(1, n_styles + 1)]
+    return rng.choices(styles, weights=weights, k=n_cells)
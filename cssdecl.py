@@ -2,182 +2,2998 @@
 
 """
 
-import re
+import os
 import warnings
-from collections import defaultdict
+from array import array
+from collections import defaultdict, deque, namedtuple, OrderedDict
+from functools import partial
+from importlib import import_module
+from itertools import islice
+try:
+    from sys import intern
+except ImportError:
+    # Python 2
+    pass
+try:
+    from _thread import allocate_lock
+except ImportError:
+    # Python 2
+    from thread import allocate_lock
+try:
+    from time import perf_counter
+except ImportError:
+    # Python 2
+    from time import time as perf_counter
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    # Python 2
+    from collections import Mapping, Sequence
+
+
+class _Lazy(object):
+    """Proxy to an object, such as a module, created on first use
+
+    Attributes are copied onto the proxy as they are accessed, so that
+    subsequent lookups cost no more than on the object itself.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, attr):
+        value = getattr(self._factory(), attr)
+        setattr(self, attr, value)
+        return value
+
+
+def _compile_regex(pattern):
+    return import_module('re').compile(pattern)
+
+
+# tinycss2 and regular expressions are only imported and compiled when
+# first needed, to keep importing cssdecl fast
+tinycss2 = _Lazy(partial(import_module, 'tinycss2'))
+_ast = _Lazy(partial(import_module, 'tinycss2.ast'))
+_color3 = _Lazy(partial(import_module, 'tinycss2.color3'))
+# only needed for a persistent cache
+_hashlib = _Lazy(partial(import_module, 'hashlib'))
+_json = _Lazy(partial(import_module, 'json'))
+_sqlite3 = _Lazy(partial(import_module, 'sqlite3'))
+_threading = _Lazy(partial(import_module, 'threading'))
+
+__version__ = '0.1.3+dev'
+
+
+__all__ = ['CSSWarning', 'CSS22Resolver', 'CompiledDeclarations',
+           'LayeredStyle', 'ComputedStyle', 'StyleRegistry', 'Diagnostics',
+           'read_declarations', 'Component', 'ComponentGrammar',
+           'SideGrammar']
+
+
+class CSSWarning(UserWarning):
+    """Warning for when this CSS syntax cannot currently be parsed"""
+    pass
+
+
+Diagnostic = namedtuple('Diagnostic',
+                        ['code', 'property', 'value', 'message'])
+
+
+class Diagnostics(Mapping):
+    """Collects problems found while resolving CSS, counting repeats
+
+    Pass an instance as a resolver's ``diagnostics`` to record problems here
+    rather than issuing a :class:`CSSWarning` for each occurrence, which is
+    slow when the same bad declaration recurs across many cells.
+
+    This is a mapping from each distinct :class:`Diagnostic`, a named tuple
+    of ``(code, property, value, message)``, to the number of times it was
+    recorded, in order of first occurrence. Codes are:
+
+    - ``'parse-error'``: invalid CSS syntax
+    - ``'unhandled-size'``: a size value that could not be converted
+    - ``'unexpandable'``: a shorthand value that could not be expanded
+
+    Parameters
+    ----------
+    emit : bool, default False
+        Whether to also issue a :class:`CSSWarning` the first time each
+        distinct diagnostic is recorded.
+
+    Examples
+    --------
+    >>> diagnostics = Diagnostics()
+    >>> resolver = CSS22Resolver(diagnostics=diagnostics)
+    >>> for _ in range(3):
+    ...     _ = resolver.resolve_string('margin: 1 2 3 4 5')
+    >>> diagnostics  # doctest: +NORMALIZE_WHITESPACE
+    Diagnostics({Diagnostic(code='unexpandable', property='margin',
+                            value='1 2 3 4 5',
+                            message='Could not expand "margin: 1 2 3 4 5"'):
+                 3})
+    """
+
+    def __init__(self, emit=False):
+        self.emit = emit
+        self._counts = OrderedDict()
+        self._lock = allocate_lock()
+
+    def record(self, diagnostic, count=1):
+        """Count an occurrence of a :class:`Diagnostic`"""
+        counts = self._counts
+        with self._lock:
+            new = diagnostic not in counts
+            counts[diagnostic] = counts.get(diagnostic, 0) + count
+        if new and self.emit:
+            warnings.warn(diagnostic.message, CSSWarning)
+
+    def update(self, other):
+        """Add the counts from another Diagnostics"""
+        for diagnostic, count in other.items():
+            self.record(diagnostic, count)
+
+    def clear(self):
+        """Forget all recorded diagnostics"""
+        with self._lock:
+            self._counts.clear()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = allocate_lock()
+
+    def __getitem__(self, diagnostic):
+        return self._counts[diagnostic]
+
+    def __iter__(self):
+        # a snapshot, as other threads may be recording
+        with self._lock:
+            return iter(list(self._counts))
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __repr__(self):
+        return '%s({%s})' % (type(self).__name__,
+                             ', '.join('%r: %r' % item
+                                       for item in self._counts.items()))
+
+
+def _warn(code, prop, value, message):
+    warnings.warn(message, CSSWarning)
+
+
+def _clean_tokens(tokens, warn=_warn, prop=None):
+    cleaned = []
+    for tok in tokens:
+        if tok.type == 'comment' or tok.type == 'whitespace':
+            pass
+        elif tok.type == 'error':
+            # TODO: indicate error context (requires
+            warn('parse-error', prop,
+                 None if prop is None else _serialize(tokens),
+                 'Error parsing CSS: %r' % tok.message)
+        else:
+            cleaned.append(tok)
+    return cleaned
+
+
+_SCAN_RE = _Lazy(partial(_compile_regex, r'''(?x)
+    (?P<ws>[ \t\n]+)
+    |(?P<num>[+-]?(?:[0-9]+(?:\.[0-9]+)?|\.[0-9]+))
+     (?P<unit>%|[a-zA-Z_][a-zA-Z0-9_-]*)?
+    |\#(?P<hash>[a-zA-Z0-9_-]+)
+    |(?P<ident>-?[a-zA-Z_][a-zA-Z0-9_-]*)
+    |(?P<punct>[:;,/])
+'''))
+# may hide a semicolon that does not end the declaration
+_SKIP_UNSAFE_RE = _Lazy(partial(_compile_regex, r'["\'()\[\]{}\\]|/\*'))
+
+
+def _scan_declarations(declarations_str, keep=None):
+    """Quickly tokenize declarations using only simple values
+
+    Values may consist of identifiers, numbers, dimensions, percentages,
+    hashes, commas and slashes. Anything else, including comments, strings,
+    functions, escapes and ``!important``, is left to tinycss2.
+
+    Parameters
+    ----------
+    declarations_str : str
+    keep : callable, optional
+        Given a lowercase property name, whether to keep its declaration.
+        Values of declarations not kept are skipped without tokenizing
+        where it is safe to do so.
+
+    Returns
+    -------
+    declarations : list of (str, list) pairs, or None
+        Lowercase property names with their values as lists of tinycss2
+        component values, equivalent to those parsed by tinycss2; or None
+        if the input is not simple.
+    """
+    ast = _ast
+    match = _SCAN_RE.match
+    out = []
+    name = None
+    value = None
+    # whether the last token requires a separator before the next
+    adjoined = False
+    pos = 0
+    end = len(declarations_str)
+    line = 1
+    last_newline = -1
+    while pos < end:
+        m = match(declarations_str, pos)
+        if m is None:
+            return None
+        kind = m.lastgroup
+        text = m.group()
+        column = pos - last_newline
+        start = pos
+        pos = m.end()
+
+        if kind == 'ws':
+            if value is not None:
+                value.append(ast.WhitespaceToken(line, column, text))
+            newlines = text.count('\n')
+            if newlines:
+                line += newlines
+                last_newline = start + text.rindex('\n')
+            adjoined = False
+            continue
+
+        if kind == 'punct':
+            if text == ';':
+                if value is not None:
+                    out.append((name.lower(), value))
+                elif name is not None:
+                    return None
+                name = value = None
+            elif text == ':':
+                if name is None or value is not None:
+                    return None
+                if keep is not None and not keep(name.lower()):
+                    skip_end = declarations_str.find(';', pos)
+                    if skip_end == -1:
+                        skip_end = end
+                    skipped = declarations_str[pos:skip_end]
+                    if not _SKIP_UNSAFE_RE.search(skipped):
+                        newlines = skipped.count('\n')
+                        if newlines:
+                            line += newlines
+                            last_newline = pos + skipped.rindex('\n')
+                        name = None
+                        pos = skip_end
+                        continue
+                value = []
+            else:
+                if value is None:
+                    return None
+                value.append(ast.LiteralToken(line, column, text))
+            adjoined = False
+            continue
+
+        if adjoined:
+            return None
+        adjoined = True
+        if value is None:
+            if kind != 'ident' or name is not None:
+                return None
+            name = text
+        elif kind == 'ident':
+            value.append(ast.IdentToken(line, column, text))
+        elif kind == 'hash':
+            hash_value = m.group('hash')
+            # whether it would start an identifier
+            if hash_value[0] == '-':
+                second = hash_value[1:2]
+                is_identifier = second != '' and not second.isdigit()
+            else:
+                is_identifier = not hash_value[0].isdigit()
+            value.append(ast.HashToken(line, column, hash_value,
+                                       is_identifier))
+        else:
+            representation = m.group('num')
+            unit = m.group('unit')
+            if unit and unit[0] in 'eE':
+                # may be an exponent
+                rest = unit[1:3].lstrip('+-')
+                if rest[:1].isdigit():
+                    return None
+            num = float(representation)
+            if '.' in representation:
+                int_value = None
+            else:
+                int_value = int(representation)
+            if unit is None:
+                token = ast.NumberToken(line, column, num, int_value,
+                                        representation)
+            elif unit == '%':
+                token = ast.PercentageToken(line, column, num, int_value,
+                                            representation)
+            else:
+                token = ast.DimensionToken(line, column, num, int_value,
+                                           representation, unit)
+            value.append(token)
+
+    if value is not None:
+        out.append((name.lower(), value))
+    elif name is not None:
+        return None
+    return out
+
+
+def _serialize(tokens):
+    """Serialize a value's component values as a normalized string"""
+    return tinycss2.serialize(tokens).strip().lower()
+
+
+_COLOR_CACHE = {}
+_COLOR_CACHE_SIZE = 4096
+
+
+def _parse_color(value):
+    """Memoized tinycss2.color3.parse_color of a token or string"""
+    key = value if isinstance(value, str) else value.serialize()
+    try:
+        return _COLOR_CACHE[key]
+    except KeyError:
+        pass
+    color = _color3.parse_color(value)
+    if len(_COLOR_CACHE) >= _COLOR_CACHE_SIZE:
+        _COLOR_CACHE.clear()
+    _COLOR_CACHE[key] = color
+    return color
+
+
+def _format_color(val, color_format):
+    """Express a color string in a canonical form, where it is understood"""
+    color = _parse_color(val)
+    if not isinstance(color, tuple):
+        return val
+    red, green, blue, alpha = color
+    rgb = (int(round(red * 255)), int(round(green * 255)),
+           int(round(blue * 255)))
+    if color_format == 'hex' and alpha == 1:
+        return '#%02x%02x%02x' % rgb
+    return 'rgba(%d, %d, %d, %s)' % (rgb + ('%g' % round(alpha, 3),))
+
+
+def match_color_token(token):
+    return _parse_color(token) is not None
+
+
+_SIZE_KEYWORDS = frozenset([
+    'medium', 'thin', 'thick', 'smaller', 'larger', 'xx-small', 'x-small',
+    'small', 'large', 'x-large', 'xx-large'])
+
+
+def match_size_token(token):
+    return (token.type == 'dimension' or token.type == 'percentage'
+            or (token.type == 'ident' and token.lower_value in _SIZE_KEYWORDS))
+
+
+def _match_font_weight(token):
+    return token.int_value in (100, 200, 300, 400, 500, 600, 700, 800, 900)
+
+
+def _match_image(token):
+    return token.type == 'url' or token.lower_name == 'url'
+
+
+class Component(object):
+    """A longhand property set by a shorthand, and the tokens it accepts
+
+    A token is accepted if it is one of ``keywords``, or if its type is one
+    of ``types`` and ``match`` (if given) accepts it.
+
+    Parameters
+    ----------
+    name : str
+        The longhand property. It may include ``{side}`` to be formatted
+        with each of a grammar's ``sides``.
+    types : collection of str, optional
+        tinycss2 token types, such as ``'dimension'`` or ``'hash'``.
+    keywords : collection of str, optional
+        Lowercase identifiers.
+    match : callable, optional
+        Called with a token of one of ``types`` to determine whether it is
+        accepted.
+    stage : int, default 0
+        Components must be given in order of stage, but those of the same
+        stage may be given in any order.
+    multiple : bool, default False
+        Whether to accept more than one token.
+    required : bool, default False
+        Whether the shorthand is invalid without this component.
+    prefix : str, optional
+        A delimiter, such as ``'/'``, which must immediately precede this
+        component, and only this component.
+    rest : bool, default False
+        Whether this takes the remainder of the value, from the first token
+        not accepted by another component, including any whitespace.
+    remainder : bool, default False
+        Whether this takes any tokens not accepted by another component.
+    """
+
+    def __init__(self, name, types=(), keywords=(), match=None, stage=0,
+                 multiple=False, required=False, prefix=None, rest=False,
+                 remainder=False):
+        self.name = name
+        self.types = frozenset(types)
+        self.keywords = frozenset(keywords)
+        self.match = match
+        self.stage = stage
+        self.multiple = multiple
+        self.required = required
+        self.prefix = prefix
+        self.rest = rest
+        self.remainder = remainder
+
+    def accepts(self, token):
+        if token.type == 'ident' and token.lower_value in self.keywords:
+            return True
+        return token.type in self.types and (self.match is None
+                                             or self.match(token))
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.name)
+
+
+class ComponentGrammar(object):
+    """Grammar for a shorthand of longhands distinguished by their values
+
+    Each token is tested only against components which accept its type,
+    or for identifiers, those with it as a keyword, before any ``match``.
+    A value of only ``inherit`` or ``initial`` applies to all components.
+
+    Parameters
+    ----------
+    components : list of Component
+        Longhands are output in this order, for each side. Where a token is
+        accepted by more than one component, the first which can still take
+        it is used.
+    sides : sequence of str, optional
+        If given, each component is output for each side.
+
+    Examples
+    --------
+    >>> class MyResolver(CSS22Resolver):
+    ...     SHORTHAND_GRAMMARS = {'list-style': ComponentGrammar([
+    ...         Component('list-style-position',
+    ...                   keywords=['inside', 'outside']),
+    ...         Component('list-style-type', remainder=True)])}
+    >>> MyResolver().resolve_string('list-style: inside square')
+    {'list-style-position': 'inside', 'list-style-type': 'square'}
+    """
+
+    def __init__(self, components, sides=None):
+        self.components = list(components)
+        self.sides = sides
+        self._compiled = None
+
+    def compile(self):
+        """Build an expander, as accepted by register_expander"""
+        if self._compiled is None:
+            self._compiled = _CompiledComponentGrammar(self)
+        return self._compiled
+
+
+class _CompiledComponentGrammar(object):
+    def __init__(self, grammar):
+        components = self.components = tuple(grammar.components)
+        if grammar.sides is None:
+            self.names = [[comp.name] for comp in components]
+        else:
+            self.names = [[comp.name.format(side=side)
+                           for side in grammar.sides]
+                          for comp in components]
+        self.n_sides = len(self.names[0]) if components else 0
+        self.required = [i for i, comp in enumerate(components)
+                         if comp.required]
+        self.rest = self.remainder = None
+        by_type = defaultdict(list)
+        by_keyword = defaultdict(list)
+        self.by_prefix = {}
+        for i, comp in enumerate(components):
+            if comp.rest:
+                self.rest = i
+            elif comp.remainder:
+                self.remainder = i
+            elif comp.prefix is not None:
+                self.by_prefix[comp.prefix] = i
+            else:
+                for kind in comp.types:
+                    by_type[kind].append(i)
+                for keyword in comp.keywords:
+                    by_keyword[keyword].append(i)
+        self.by_type = dict((k, tuple(v)) for k, v in by_type.items())
+        self.by_keyword = dict((k, tuple(v)) for k, v in by_keyword.items())
+
+    def expanded_properties(self, sides):
+        return [name for names in self.names for name in names]
+
+    def _lookup(self, token, stage, matched):
+        components = self.components
+        kind = token.type
+        if kind == 'ident':
+            for i in self.by_keyword.get(token.lower_value, ()):
+                comp = components[i]
+                if comp.stage >= stage and (comp.multiple
+                                            or i not in matched):
+                    return i
+        elif kind == 'literal':
+            i = self.by_prefix.get(token.value)
+            if i is not None:
+                comp = components[i]
+                if comp.stage >= stage and (comp.multiple
+                                            or i not in matched):
+                    return i
+            return None
+        for i in self.by_type.get(kind, ()):
+            comp = components[i]
+            if comp.stage >= stage and (comp.multiple or i not in matched):
+                if comp.match is None or comp.match(token):
+                    return i
+        return None
+
+    def __call__(self, resolver, prop, value):
+        components = self.components
+        matched = {}
+        stage = 0
+        # component awaited after its prefix
+        expect = None
+        keyword = None
+        for pos, token in enumerate(value):
+            kind = token.type
+            if kind == 'whitespace' or kind == 'comment':
+                continue
+            if kind == 'error':
+                resolver._warn('parse-error', prop, _serialize(value),
+                               'Error parsing CSS: %r' % token.message)
+                continue
+            if kind == 'ident' and (token.lower_value == 'inherit'
+                                    or token.lower_value == 'initial'):
+                keyword = token
+                continue
+            if expect is not None:
+                if not components[expect].accepts(token):
+                    return self._invalid(resolver, prop, value)
+                matched[expect] = [token]
+                expect = None
+                continue
+            i = self._lookup(token, stage, matched)
+            if i is None:
+                if kind == 'literal' and token.value in self.by_prefix:
+                    # a prefix repeated or out of order
+                    return self._invalid(resolver, prop, value)
+                if (self.rest is not None
+                        and components[self.rest].stage >= stage):
+                    matched[self.rest] = value[pos:]
+                    break
+                if self.remainder is None:
+                    return self._invalid(resolver, prop, value)
+                i = self.remainder
+            elif components[i].prefix is not None:
+                expect = i
+                stage = components[i].stage
+                continue
+            else:
+                stage = components[i].stage
+            tokens = matched.get(i)
+            if tokens is None:
+                matched[i] = [token]
+            else:
+                # separate multiple values, e.g. of background-position
+                tokens.append(_ast.WhitespaceToken(token.source_line,
+                                                   token.source_column, ' '))
+                tokens.append(token)
+
+        if keyword is not None:
+            # which must stand alone
+            if matched or expect is not None:
+                return self._invalid(resolver, prop, value)
+            matched = dict((i, [keyword]) for i in range(len(components)))
+        elif expect is not None:
+            return self._invalid(resolver, prop, value)
+        else:
+            for i in self.required:
+                if i not in matched:
+                    return self._invalid(resolver, prop, value)
+
+        out = []
+        names = self.names
+        for side in range(self.n_sides):
+            for i in range(len(components)):
+                tokens = matched.get(i)
+                if tokens:
+                    out.append((names[i][side], tokens))
+        return out
+
+    def _invalid(self, resolver, prop, value):
+        value = _serialize(value)
+        resolver._warn('unexpandable', prop, value,
+                       'Could not expand "%s: %s"' % (prop, value))
+        return ()
+
+
+class SideGrammar(object):
+    """Grammar for a shorthand of one to four values for each side
+
+    One value applies to all sides; two give top and bottom, then right and
+    left; three give top, right and left, then bottom; and four give each
+    side clockwise from the top.
+
+    Parameters
+    ----------
+    name : str
+        The longhand property with ``{side}`` for each side, e.g.
+        ``'margin-{side}'``.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._compiled = None
+
+    def compile(self):
+        """Build an expander, as accepted by register_expander"""
+        if self._compiled is None:
+            self._compiled = _CompiledSideGrammar(self)
+        return self._compiled
+
+
+class _CompiledSideGrammar(object):
+    def __init__(self, grammar):
+        self.name = grammar.name
+        # longhand names, for each resolver's SIDES
+        self.names = {}
+
+    def expanded_properties(self, sides):
+        return [self.name.format(side=side) for side in sides]
+
+    def __call__(self, resolver, prop, value):
+        tokens = _clean_tokens(value, resolver._warn, prop)
+        try:
+            mapping = resolver.SIDE_SHORTHANDS[len(tokens)]
+        except KeyError:
+            value = _serialize(value)
+            resolver._warn('unexpandable', prop, value,
+                           'Could not expand "%s: %s"' % (prop, value))
+            return ()
+        sides = resolver.SIDES
+        try:
+            names = self.names[sides]
+        except KeyError:
+            names = self.names[sides] = [self.name.format(side=side)
+                                         for side in sides]
+        return [(name, tokens[idx:idx + 1])
+                for name, idx in zip(names, mapping)]
+
+
+CacheInfo = namedtuple('CacheInfo',
+                       ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+
+class _LRUStripe(object):
+    """Bounded mapping which evicts the least recently used entry when full
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = allocate_lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            data = self._data
+            data.pop(key, None)
+            data[key] = value
+            if len(data) > self.maxsize:
+                data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _LRUCache(object):
+    """Least recently used cache which may be shared between threads
+
+    Larger caches are split by key hash into stripes, each with its own lock
+    and evicting its own least recently used entry, so that threads seldom
+    wait for each other.
+    """
+
+    STRIPE_SIZE = 256
+    MAX_STRIPES = 16
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        n_stripes = max(1, min(self.MAX_STRIPES, maxsize // self.STRIPE_SIZE))
+        self._stripes = [_LRUStripe(maxsize // n_stripes
+                                    + (i < maxsize % n_stripes))
+                         for i in range(n_stripes)]
+        if n_stripes == 1:
+            # avoid hashing keys to choose a stripe
+            self.get = self._stripes[0].get
+            self.set = self._stripes[0].set
+
+    def _stripe(self, key):
+        stripes = self._stripes
+        return stripes[hash(key) % len(stripes)]
+
+    def get(self, key, default=None):
+        return self._stripe(key).get(key, default)
+
+    def set(self, key, value):
+        self._stripe(key).set(key, value)
+
+    def clear(self):
+        for stripe in self._stripes:
+            stripe.clear()
+
+    @property
+    def evictions(self):
+        return sum(stripe.evictions for stripe in self._stripes)
+
+    def info(self):
+        stripes = self._stripes
+        return CacheInfo(sum(stripe.hits for stripe in stripes),
+                         sum(stripe.misses for stripe in stripes),
+                         self.evictions, self.maxsize, len(self))
+
+    def __len__(self):
+        return sum(len(stripe) for stripe in self._stripes)
+
+
+PhaseStats = namedtuple('PhaseStats', ['calls', 'seconds'])
+
+
+class _Profiler(object):
+    """Accumulates call counts and time for each phase of resolution
+
+    Phases are timed by shadowing resolver methods with instance attributes,
+    so that resolvers without a profiler pay nothing.
+    """
+
+    # resolver method -> phase name
+    METHODS = {
+        '_parse': 'parse',
+        '_resolve_inherit': 'inherit',
+        '_resolve_font_size': 'font-size',
+        '_convert_size': 'size',
+        '_warn': 'warn',
+    }
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.totals = {}
+        self._lock = allocate_lock()
+        self._expanders = (None, None)
+
+    def record(self, phase, seconds):
+        with self._lock:
+            try:
+                totals = self.totals[phase]
+            except KeyError:
+                totals = self.totals[phase] = [0, 0.]
+            totals[0] += 1
+            totals[1] += seconds
+        if self.callback is not None:
+            self.callback(phase, seconds)
+
+    def wrap(self, phase, func, materialize=False):
+        record = self.record
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                out = func(*args, **kwargs)
+                if materialize:
+                    # consume generators to time their work
+                    out = list(out)
+                return out
+            finally:
+                record(phase, perf_counter() - start)
+
+        return timed
+
+    def install(self, resolver):
+        for name, phase in self.METHODS.items():
+            setattr(resolver, name, self.wrap(phase, getattr(resolver, name),
+                                              materialize=name == '_parse'))
+        get_expanders = resolver._get_expanders
+
+        def get_timed_expanders():
+            expanders = get_expanders()
+            if self._expanders[0] is not expanders:
+                timed = dict((prop, self.wrap('expand:' + prop, expand,
+                                              materialize=True))
+                             for prop, expand in expanders.items())
+                self._expanders = (expanders, timed)
+            return self._expanders[1]
+
+        resolver._get_expanders = get_timed_expanders
+
+    @classmethod
+    def uninstall(cls, state):
+        for name in cls.METHODS:
+            state.pop(name, None)
+        state.pop('_get_expanders', None)
+
+    def snapshot(self):
+        with self._lock:
+            return dict((phase, PhaseStats(calls, seconds))
+                        for phase, (calls, seconds) in self.totals.items())
+
+    def clear(self):
+        with self._lock:
+            self.totals.clear()
+
+
+_VERSION_RE = _Lazy(partial(_compile_regex, r'[0-9]+'))
+
+
+def _version_key(version):
+    """Order release versions, ignoring any local part after '+'"""
+    return tuple(int(part) for part in
+                 _VERSION_RE.findall(version.split('+')[0]))
+
+
+class _PersistentCache(object):
+    """Resolution cache in an SQLite database, shared between processes
+
+    Keys are hashed stably together with ``namespace``, which should identify
+    the resolver configuration, and the version of cssdecl. Entries written
+    by older versions are deleted when a newer version first connects, as
+    recorded in a ``meta`` table. Recently used entries may also be held in
+    ``memory``, an _LRUCache.
+
+    Values are stored as JSON rather than pickled, so that whoever can write
+    to the file cannot run code in its readers.
+
+    Each thread has its own connection, as SQLite connections may not be
+    shared.
+    """
+
+    TIMEOUT = 30.
+
+    def __init__(self, path, namespace, memory=None):
+        self.path = path
+        self.namespace = namespace
+        self.memory = memory
+        self.hits = self.misses = 0
+        self._lock = allocate_lock()
+        self._local = _threading.local()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def conn(self):
+        local = self._local
+        # connections must not be shared with forked processes
+        if getattr(local, 'pid', None) != os.getpid():
+            conn = _sqlite3.connect(self.path, timeout=self.TIMEOUT,
+                                    isolation_level=None)
+            # allow readers to proceed while another process writes
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS resolved '
+                         '(key BLOB PRIMARY KEY, namespace TEXT, '
+                         'version TEXT, value BLOB)')
+            conn.execute('CREATE INDEX IF NOT EXISTS resolved_namespace '
+                         'ON resolved (namespace, version)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                         '(name TEXT PRIMARY KEY, value TEXT)')
+            self._purge(conn)
+            local.conn = conn
+            local.pid = os.getpid()
+        return local.conn
+
+    @staticmethod
+    def _purge(conn):
+        """Delete entries from older versions, if this version is newer"""
+        row = conn.execute("SELECT value FROM meta WHERE name = 'version'"
+                           ).fetchone()
+        if row is not None and (_version_key(row[0])
+                                >= _version_key(__version__)):
+            # a version sharing this file, which may still be in use
+            return
+        conn.execute('DELETE FROM resolved WHERE version != ?',
+                     (__version__,))
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                     (__version__,))
+
+    @staticmethod
+    def _dumps(value):
+        """Serialize resolved properties to JSON, tagging colors"""
+        items = []
+        for prop, val in value.items():
+            if isinstance(val, _color3.RGBA):
+                val = {'rgba': list(val)}
+            elif not isinstance(val, (str, float, int, type(None))):
+                raise TypeError('Cannot store %r' % (val,))
+            items.append([prop, val])
+        return _json.dumps({'style': isinstance(value, ComputedStyle),
+                            'items': items})
+
+    @staticmethod
+    def _loads(text):
+        data = _json.loads(text)
+        items = [(prop, _color3.RGBA(*val['rgba'])
+                  if isinstance(val, dict) else val)
+                 for prop, val in data['items']]
+        if data['style']:
+            return ComputedStyle(items)
+        return dict(items)
+
+    def _hash(self, key):
+        declarations_str, frozen, typed, as_style, properties = key
+        if frozen is not None:
+            frozen = sorted(frozen.items() if isinstance(frozen, Mapping)
+                            else frozen)
+        if properties is not None:
+            properties = sorted(properties)
+        text = repr((self.namespace, __version__, declarations_str, frozen,
+                     typed, as_style, properties))
+        return _hashlib.sha256(text.encode('utf8')).digest()
+
+    def get(self, key, default=None):
+        if self.memory is not None:
+            value = self.memory.get(key)
+            if value is not None:
+                self._count(True)
+                return value
+        try:
+            row = self.conn.execute('SELECT value FROM resolved '
+                                    'WHERE key = ?',
+                                    (self._hash(key),)).fetchone()
+        except _sqlite3.OperationalError:
+            # e.g. locked for longer than TIMEOUT: resolve afresh
+            row = None
+        try:
+            value = None if row is None else self._loads(row[0])
+        except (ValueError, TypeError, KeyError):
+            # e.g. written in another format
+            value = None
+        if value is None:
+            self._count(False)
+            return default
+        if self.memory is not None:
+            self.memory.set(key, value)
+        self._count(True)
+        return value
+
+    def set(self, key, value):
+        if self.memory is not None:
+            self.memory.set(key, value)
+        try:
+            text = self._dumps(value)
+        except TypeError:
+            # e.g. values of a type added by a subclass
+            return
+        try:
+            self.conn.execute('INSERT OR REPLACE INTO resolved '
+                              'VALUES (?, ?, ?, ?)',
+                              (self._hash(key), self.namespace, __version__,
+                               text))
+        except _sqlite3.OperationalError:
+            pass
+
+    def clear(self):
+        if self.memory is not None:
+            self.memory.clear()
+        self.conn.execute('DELETE FROM resolved '
+                          'WHERE namespace = ? AND version = ?',
+                          (self.namespace, __version__))
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def info(self):
+        memory = self.memory
+        return CacheInfo(self.hits, self.misses,
+                         0 if memory is None else memory.evictions,
+                         None if memory is None else memory.maxsize,
+                         len(self))
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM resolved '
+                                 'WHERE namespace = ? AND version = ?',
+                                 (self.namespace,
+                                  __version__)).fetchone()[0]
+
+
+def _freeze_inherited(inherited):
+    """Hashable snapshot of an inherited context, for use in cache keys"""
+    if not inherited:
+        return None
+    if isinstance(inherited, ComputedStyle):
+        return inherited
+    return frozenset(inherited.items())
+
+
+def _factorize(declarations, inherited=None):
+    """Identify distinct (declarations_str, inherited) among many
+
+    Returns
+    -------
+    uniques : list of (str, dict or None) tuples
+    codes : list of int
+        For each input, its index into ``uniques``
+    """
+    default_frozen = _freeze_inherited(inherited)
+    index = {}
+    uniques = []
+    codes = []
+    for item in declarations:
+        if isinstance(item, str):
+            declarations_str = item
+            key = (item, default_frozen)
+            context = inherited
+        else:
+            declarations_str, context = item
+            key = (declarations_str, _freeze_inherited(context))
+        code = index.get(key)
+        if code is None:
+            code = index[key] = len(uniques)
+            uniques.append((declarations_str, context))
+        codes.append(code)
+    return uniques, codes
+
+
+def _factorize_array(values):
+    """Identify distinct values in a 1d object array, vectorized if possible
+
+    Returns
+    -------
+    uniques : list
+        Missing values (None and NaN, if pandas is available) become None.
+    codes : ndarray of int
+    """
+    import numpy as np
+    try:
+        import pandas as pd
+    except ImportError:
+        index = {}
+        codes = np.fromiter((index.setdefault(value, len(index))
+                             for value in values),
+                            dtype=np.intp, count=len(values))
+        return list(index), codes
+
+    codes, uniques = pd.factorize(values)
+    uniques = list(uniques)
+    missing = codes < 0
+    if missing.any():
+        codes[missing] = len(uniques)
+        uniques.append(None)
+    return uniques, codes
+
+
+_READ_SIZE = 1 << 16
+
+
+def _split_chunks(chunks, sep):
+    """Split text arriving in chunks, holding at most one part in memory"""
+    buf = ''
+    for chunk in chunks:
+        buf += chunk
+        if sep in chunk:
+            parts = buf.split(sep)
+            buf = parts.pop()
+            for part in parts:
+                yield part
+    if buf:
+        yield buf
+
+
+def read_declarations(source, format='lines'):
+    """Lazily read declaration blocks from a file or iterable
+
+    Parameters
+    ----------
+    source : file-like or iterable of str
+        A text-mode file, or any iterable of lines (or, for ``'nul'``
+        format, of chunks of text).
+    format : {'lines', 'jsonl', 'nul'}, default 'lines'
+        - ``'lines'``: each line is a block of declarations
+        - ``'jsonl'``: each non-blank line is a JSON string, or an object
+          with key ``"declarations"`` and optionally ``"inherited"``, an
+          object of atomic properties
+        - ``'nul'``: blocks are delimited by ``'\\0'``, and may span lines
+
+    Yields
+    ------
+    item : str or (str, dict) tuple
+        A declarations string, or for JSONL records with ``"inherited"``, a
+        pair of declarations and inherited context, as accepted by
+        :meth:`CSS22Resolver.resolve_iter`.
+
+    Examples
+    --------
+    >>> import io
+    >>> list(read_declarations(io.StringIO('color: red\\0margin: 0'),
+    ...                        format='nul'))
+    ['color: red', 'margin: 0']
+    """
+    if format == 'lines':
+        for line in source:
+            yield line.rstrip('\r\n')
+    elif format == 'jsonl':
+        import json
+        for line in source:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict):
+                if record.get('inherited') is not None:
+                    record = (record['declarations'], record['inherited'])
+                else:
+                    record = record['declarations']
+            yield record
+    elif format == 'nul':
+        if hasattr(source, 'read'):
+            source = iter(partial(source.read, _READ_SIZE), '')
+        for block in _split_chunks(source, '\0'):
+            yield block
+    else:
+        raise ValueError('format must be "lines", "jsonl" or "nul", got %r'
+                         % (format,))
+
+
+_SIZE_RE = _Lazy(partial(_compile_regex, r'^(\S*?)([a-zA-Z%!].*)'))
+_SIZE_MEMO_SIZE = 4096
+
+
+class _SizeConverter(object):
+    """Converts sizes to pt using a flattened table of unit ratios
+
+    Parameters
+    ----------
+    conversions : dict
+        Maps a unit to a pair ``(unit, multiplier)`` expressing it in terms
+        of another unit, eventually ``'pt'`` or ``'em'``.
+    """
+
+    def __init__(self, conversions):
+        # unit -> (multiplier, em_relative) where the multiplier converts
+        # to pt, or to em if em_relative
+        ratios = {'pt': (1, False), 'em': (1, True)}
+        for unit in conversions:
+            mul = 1
+            seen = set()
+            target = unit
+            while target not in ('pt', 'em'):
+                if target in seen or target not in conversions:
+                    break
+                seen.add(target)
+                target, factor = conversions[target]
+                mul *= factor
+            else:
+                ratios[unit] = (mul, target == 'em')
+        self.ratios = ratios
+        rem = ratios.get('rem')
+        if rem is None or rem[1]:
+            self.rem_pt = None
+        else:
+            self.rem_pt = rem[0]
+        self.memo = {}
+
+    def _parse(self, in_val):
+        match = _SIZE_RE.match(in_val)
+        if match is None:
+            return None
+        val, unit = match.groups()
+        if val == '':
+            # hack for 'large' etc.
+            val = 1
+        else:
+            try:
+                val = float(val)
+            except ValueError:
+                return None
+
+        try:
+            mul, em_relative = self.ratios[unit]
+        except KeyError:
+            return None
+        return val * mul, em_relative
+
+    def is_em_relative(self, in_val):
+        """Whether the size, if understood, depends on the font size"""
+        parsed = self._parse(in_val)
+        return parsed is not None and parsed[1]
+
+    def to_pt(self, in_val, em_pt=None):
+        """Convert a size to a float in pt, or None if not understood"""
+        parsed = self._parse(in_val)
+        if parsed is None:
+            return None
+        val, em_relative = parsed
+        if em_relative:
+            if em_pt is None:
+                em_pt = self.rem_pt
+                if em_pt is None:
+                    return None
+            val *= em_pt
+        return val
+
+
+_SIZE_CONVERTERS = {}
+
+
+def _get_size_converter(conversions):
+    """Get the converter for a table of ratios, building it on first use
+
+    Tables of ratios should not be modified once used.
+    """
+    try:
+        table, converter = _SIZE_CONVERTERS[id(conversions)]
+    except KeyError:
+        pass
+    else:
+        if table is conversions:
+            return converter
+    converter = _SizeConverter(conversions)
+    # keep a reference to the table so that its id is not reused
+    _SIZE_CONVERTERS[id(conversions)] = (conversions, converter)
+    return converter
+
+
+def _font_size_pt(inherited):
+    """Get the inherited font size as a float, or None"""
+    em_pt = inherited.get('font-size') if inherited else None
+    if isinstance(em_pt, str):
+        assert em_pt[-2:] == 'pt'
+        em_pt = float(em_pt[:-2])
+    return em_pt
+
+
+# marks a property removed from a LayeredStyle's parent
+_REMOVED = object()
+_DEFAULT = object()
+
+
+class LayeredStyle(Mapping):
+    """A read-only computed style which shares its parent style's entries
+
+    These are output by :meth:`CSS22Resolver.resolve_tree`, and may be used
+    wherever a dict of atomic properties would be, including as the
+    ``inherited`` context for resolution.
+
+    Parameters
+    ----------
+    own : dict
+        Properties set, or overridden, by this style
+    parent : LayeredStyle, optional
+        The style to which lookups fall back
+    """
+
+    # limit the cost of lookups in deep hierarchies
+    MAX_DEPTH = 8
+
+    __slots__ = ('_own', '_parent', '_len')
+
+    def __init__(self, own, parent=None):
+        if parent is not None and parent._depth() >= self.MAX_DEPTH:
+            flat = dict(parent)
+            for prop, val in own.items():
+                if val is _REMOVED:
+                    flat.pop(prop, None)
+                else:
+                    flat[prop] = val
+            own = flat
+            parent = None
+        self._own = own
+        self._parent = parent
+        self._len = None
+
+    def _depth(self):
+        depth = 1
+        style = self._parent
+        while style is not None:
+            depth += 1
+            style = style._parent
+        return depth
+
+    def __getitem__(self, prop):
+        style = self
+        while style is not None:
+            own = style._own
+            if prop in own:
+                val = own[prop]
+                if val is _REMOVED:
+                    break
+                return val
+            style = style._parent
+        raise KeyError(prop)
+
+    def get(self, prop, default=None):
+        try:
+            return self[prop]
+        except KeyError:
+            return default
+
+    def __contains__(self, prop):
+        try:
+            self[prop]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        seen = set()
+        style = self
+        while style is not None:
+            for prop, val in style._own.items():
+                if prop not in seen:
+                    seen.add(prop)
+                    if val is not _REMOVED:
+                        yield prop
+            style = style._parent
+
+    def __len__(self):
+        if self._len is None:
+            self._len = sum(1 for _ in self)
+        return self._len
+
+    def __reduce__(self):
+        # flattened, as _REMOVED would not survive pickling
+        return type(self), (dict(self),)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, dict(self))
+
+
+class _StyleLayout(object):
+    """The property names of a ComputedStyle, shared among styles"""
+
+    __slots__ = ('props', 'index')
+
+    def __init__(self, props):
+        self.props = props
+        self.index = dict((prop, i) for i, prop in enumerate(props))
+
+
+_STYLE_LAYOUTS = {}
+
+
+def _intern_value(val):
+    if type(val) is str:
+        return intern(val)
+    return val
+
+
+class ComputedStyle(Mapping):
+    """Compact, immutable and hashable atomic properties
+
+    Property names and string values are interned, and styles with the same
+    set of properties share a single index from property name to position,
+    so each style stores little more than a tuple of its values. Styles are
+    hashable and compare equal to each other or to dicts with the same
+    items.
+
+    These are output by :meth:`CSS22Resolver.resolve_style`, and may be
+    used as the ``inherited`` context for resolution.
+
+    Parameters
+    ----------
+    props : dict or iterable of pairs
+        Atomic properties mapped to their values, which must be hashable.
+
+    Examples
+    --------
+    >>> style = ComputedStyle({'font-weight': 'bold', 'color': 'red'})
+    >>> style['color']
+    'red'
+    >>> style == ComputedStyle([('color', 'red'), ('font-weight', 'bold')])
+    True
+    """
+
+    __slots__ = ('_layout', '_values', '_hash')
+
+    def __init__(self, props=()):
+        if isinstance(props, ComputedStyle):
+            items = props.items()
+        else:
+            items = sorted(dict(props).items())
+        names = tuple(intern(prop) for prop, _ in items)
+        try:
+            layout = _STYLE_LAYOUTS[names]
+        except KeyError:
+            layout = _STYLE_LAYOUTS.setdefault(names, _StyleLayout(names))
+        self._layout = layout
+        self._values = tuple(_intern_value(val) for _, val in items)
+        self._hash = hash((layout.props, self._values))
+
+    def __getitem__(self, prop):
+        return self._values[self._layout.index[prop]]
+
+    def get(self, prop, default=None):
+        idx = self._layout.index.get(prop)
+        if idx is None:
+            return default
+        return self._values[idx]
+
+    def __contains__(self, prop):
+        return prop in self._layout.index
+
+    def __iter__(self):
+        return iter(self._layout.props)
+
+    def __len__(self):
+        return len(self._values)
+
+    def items(self):
+        return list(zip(self._layout.props, self._values))
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, ComputedStyle):
+            if self._hash != other._hash or self._layout is not other._layout:
+                return False
+            return self._values == other._values
+        return Mapping.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __reduce__(self):
+        return type(self), (list(self.items()),)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, dict(self.items()))
+
+
+class StyleRegistry(Sequence):
+    """Distinct computed styles, each identified by a small integer id
+
+    Interning the output of :meth:`CSS22Resolver.resolve_string` here lets a
+    writer build one format object per distinct style, indexed by id, and
+    map each cell to its format by that id. Ids are assigned in order from
+    0 as new styles are interned, and never change.
+
+    Styles are held as :class:`ComputedStyle`, whose canonical property order
+    and precomputed hash make looking up an id a single dict lookup.
+
+    This is a sequence of styles indexed by id, and
+    :meth:`CSS22Resolver.resolve_ids` adds to it.
+
+    Parameters
+    ----------
+    styles : iterable of dict or ComputedStyle, optional
+        Styles to intern initially.
+
+    Examples
+    --------
+    >>> registry = StyleRegistry()
+    >>> registry.intern({'font-weight': 'bold', 'color': 'red'})
+    0
+    >>> registry.intern({'color': 'blue'})
+    1
+    >>> registry.intern({'color': 'red', 'font-weight': 'bold'})
+    0
+    >>> registry[1]
+    ComputedStyle({'color': 'blue'})
+    """
+
+    def __init__(self, styles=()):
+        self._ids = {}
+        self._styles = []
+        self._lock = allocate_lock()
+        for props in styles:
+            self.intern(props)
+
+    def intern(self, props):
+        """Get the id of a style, adding the style if new
+
+        Parameters
+        ----------
+        props : dict or ComputedStyle
+            Atomic properties, as output by
+            :meth:`CSS22Resolver.resolve_string`.
+
+        Returns
+        -------
+        style_id : int
+        """
+        if not isinstance(props, ComputedStyle):
+            props = ComputedStyle(props)
+        style_id = self._ids.get(props)
+        if style_id is None:
+            with self._lock:
+                style_id = self._ids.get(props)
+                if style_id is None:
+                    style_id = len(self._styles)
+                    self._styles.append(props)
+                    self._ids[props] = style_id
+        return style_id
+
+    def index(self, props):
+        """Get the id of a style, raising ValueError if not interned"""
+        if not isinstance(props, ComputedStyle):
+            props = ComputedStyle(props)
+        try:
+            return self._ids[props]
+        except KeyError:
+            raise ValueError('%r is not in registry' % (props,))
+
+    def __contains__(self, props):
+        if not isinstance(props, ComputedStyle):
+            props = ComputedStyle(props)
+        return props in self._ids
+
+    def __getitem__(self, style_id):
+        return self._styles[style_id]
+
+    def __iter__(self):
+        return iter(self._styles)
+
+    def __len__(self):
+        return len(self._styles)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = allocate_lock()
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self._styles)
+
+
+def _parse_color_value(val):
+    """Parse a color to an RGBA tuple, or leave it as a string"""
+    color = _parse_color(val)
+    if isinstance(color, tuple):
+        return color
+    return val
+
+
+class CompiledDeclarations(object):
+    """Declarations parsed and expanded, ready to resolve in any context
+
+    Instances are constructed by :meth:`CSS22Resolver.compile`, and are
+    immutable. Resolving them only performs the work that depends on the
+    inherited context.
+
+    Attributes
+    ----------
+    declarations_str : str
+        The declarations compiled
+    context_dependent : frozenset
+        Atomic properties whose resolved value depends on the inherited
+        context
+    """
+
+    __slots__ = ('_resolver', '_declarations_str', '_static', '_static_sizes',
+                 '_typed_static', '_font_size', '_font_pt', '_font_static',
+                 '_inherit', '_removed', '_relative', '_em_static',
+                 '_properties')
+
+    def __init__(self, resolver, declarations_str, static, static_sizes,
+                 font_size, font_pt, font_static, inherit, removed,
+                 relative, em_static=(), properties=None):
+        self._resolver = resolver
+        self._declarations_str = declarations_str
+        # atomic properties to output, or None for all
+        self._properties = properties
+        # values resolved without context
+        self._static = static
+        self._static_sizes = static_sizes
+        self._typed_static = None
+        # font size requiring the inherited font size, if any
+        self._font_size = font_size
+        # otherwise, whether the font size is known without context
+        self._font_static = font_static
+        self._font_pt = font_pt
+        self._inherit = inherit
+        self._removed = removed
+        # sizes requiring the font size: (prop, value, conversions)
+        self._relative = relative
+        # sizes relative to the font size declared here, in the same form
+        self._em_static = em_static
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self._declarations_str)
+
+    @property
+    def declarations_str(self):
+        return self._declarations_str
+
+    @property
+    def context_dependent(self):
+        out = set(self._inherit)
+        out.update(prop for prop, _, _ in self._relative)
+        if self._font_size is not None:
+            out.add('font-size')
+        return frozenset(out)
+
+    def resolve(self, inherited=None, typed=False):
+        """Resolve these declarations to atomic properties
+
+        Parameters
+        ----------
+        inherited : dict, optional
+            Atomic properties indicating the inherited style context. See
+            :meth:`CSS22Resolver.resolve_string`.
+        typed : bool, default False
+            Whether to output typed values as in
+            :meth:`CSS22Resolver.resolve_typed`.
+
+        Returns
+        -------
+        props : dict
+            Atomic CSS 2.2 properties mapped to their values
+        """
+        return self._resolver._resolve_compiled(self, inherited, typed)
+
+    def _get_typed_static(self):
+        typed_static = self._typed_static
+        if typed_static is None:
+            typed_static = dict(self._static)
+            typed_static.update(self._static_sizes)
+            for prop in self._resolver.COLOR_PROPERTIES:
+                val = typed_static.get(prop)
+                if val is not None:
+                    typed_static[prop] = _parse_color_value(val)
+            self._typed_static = typed_static
+        return typed_static
+
+
+def _resolve_chunk(resolver, uniques, typed=False, properties=None):
+    """Resolve a list of (declarations_str, inherited) pairs"""
+    resolve = resolver.resolve_typed if typed else resolver.resolve_string
+    return [resolve(declarations_str, context, properties=properties)
+            for declarations_str, context in uniques]
+
+
+def _resolve_chunk_remote(resolver, uniques, typed=False, properties=None):
+    """Resolve in a worker process, also returning any diagnostics"""
+    return (_resolve_chunk(resolver, uniques, typed, properties),
+            resolver.diagnostics)
+
+
+def _get_loop():
+    import asyncio
+    try:
+        return asyncio.get_running_loop()
+    except AttributeError:
+        # Python < 3.7
+        return asyncio.get_event_loop()
+
+
+def _resolve_chunk_async(loop, resolver, uniques, typed=False, executor=None,
+                         properties=None):
+    """Resolve a list of pairs in an executor, or soon in the loop
+
+    Returns
+    -------
+    future : asyncio.Future
+        Resolving to the list of atomic properties.
+    """
+    future = loop.create_future()
+
+    def run():
+        if future.cancelled():
+            return
+        try:
+            future.set_result(_resolve_chunk(resolver, uniques, typed,
+                                             properties))
+        except Exception as exc:
+            future.set_exception(exc)
+
+    def done(inner):
+        if future.cancelled():
+            return
+        if inner.cancelled():
+            future.cancel()
+        elif inner.exception() is not None:
+            future.set_exception(inner.exception())
+        else:
+            resolved, diagnostics = inner.result()
+            if diagnostics is not resolver.diagnostics:
+                # from a worker process
+                resolver.diagnostics.update(diagnostics)
+            future.set_result(resolved)
+
+    if executor is None:
+        loop.call_soon(run)
+    else:
+        loop.run_in_executor(executor, _resolve_chunk_remote, resolver,
+                             uniques, typed,
+                             properties).add_done_callback(done)
+    return future
+
+
+class _AsyncResolveIterator(object):
+    """Asynchronous iterator returned by CSS22Resolver.aresolve_iter"""
+
+    def __init__(self, resolver, declarations, inherited, typed, chunksize,
+                 executor, properties=None):
+        self._resolver = resolver
+        self._items = iter(declarations)
+        self._inherited = inherited
+        self._default_frozen = _freeze_inherited(inherited)
+        self._typed = typed
+        self._chunksize = chunksize
+        self._executor = executor
+        self._properties = properties
+        # distinct items seen in this request, so each is resolved once
+        self._resolved = {}
+        self._buffer = deque()
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        loop = _get_loop()
+        future = loop.create_future()
+        if self._buffer:
+            future.set_result(self._buffer.popleft())
+            return future
+
+        keys = []
+        pending = OrderedDict()
+        for item in islice(self._items, self._chunksize):
+            if isinstance(item, str):
+                key = (item, self._default_frozen)
+                item = (item, self._inherited)
+            else:
+                key = (item[0], _freeze_inherited(item[1]))
+            if key not in self._resolved:
+                pending[key] = item
+            keys.append(key)
+        if not keys:
+            future.set_exception(StopAsyncIteration())
+            return future
+
+        def done(inner):
+            if future.cancelled():
+                return
+            if inner.cancelled():
+                future.cancel()
+                return
+            if inner.exception() is not None:
+                future.set_exception(inner.exception())
+                return
+            self._resolved.update(zip(pending, inner.result()))
+            self._buffer.extend(self._resolved[key] for key in keys)
+            future.set_result(self._buffer.popleft())
+
+        _resolve_chunk_async(loop, self._resolver, list(pending.values()),
+                             self._typed, self._executor,
+                             self._properties).add_done_callback(done)
+        return future
+
+
+class _BaseCSSResolver(object):
+    """Base class for parsing and resolving CSS to atomic properties
+
+    """
+
+    def __init__(self, initial=None, cache_size=0, color_format=None,
+                 profile=False, diagnostics=None, cache_path=None):
+        if color_format not in (None, 'hex', 'rgba'):
+            raise ValueError('color_format must be None, "hex" or "rgba", '
+                             'got %r' % (color_format,))
+        self.color_format = color_format
+        initial = initial or {}
+        if color_format is not None:
+            initial = dict(initial)
+            for prop in self.COLOR_PROPERTIES:
+                if prop in initial:
+                    initial[prop] = _format_color(initial[prop],
+                                                  color_format)
+        self.initial = initial
+        self.cache_size = cache_size
+        self.cache_path = cache_path
+        self.diagnostics = diagnostics
+        self._cache = self._make_cache()
+        if profile:
+            self._profiler = _Profiler(None if profile is True else profile)
+            self._profiler.install(self)
+        else:
+            self._profiler = None
+
+    def cache_info(self):
+        """Report statistics for the resolution cache
+
+        Returns
+        -------
+        info : CacheInfo or None
+            A named tuple of ``(hits, misses, evictions, maxsize, currsize)``,
+            or None if this resolver was constructed without ``cache_size``
+            or ``cache_path``. For a persistent cache, ``maxsize`` is that of
+            the in-memory cache, and ``currsize`` counts stored entries.
+
+        Examples
+        --------
+        >>> resolver = CSS22Resolver(cache_size=2)
+        >>> _ = resolver.resolve_string('color: red')
+        >>> _ = resolver.resolve_string('color: red')
+        >>> resolver.cache_info()
+        CacheInfo(hits=1, misses=1, evictions=0, maxsize=2, currsize=1)
+        """
+        if self._cache is None:
+            return None
+        return self._cache.info()
+
+    def cache_clear(self):
+        """Empty the resolution cache and reset its statistics
+
+        With ``cache_path``, this removes entries stored for resolvers
+        configured like this one.
+        """
+        if self._cache is not None:
+            self._cache.clear()
+
+    @property
+    def stats(self):
+        """Cumulative calls and time for each phase of resolution
+
+        None unless this resolver was constructed with ``profile``. Otherwise
+        a dict mapping phase name to a named tuple of ``(calls, seconds)``.
+        Phases are:
+
+        - ``'parse'``: tokenizing declarations
+        - ``'expand:<prop>'``: expanding each shorthand property
+        - ``'inherit'``: resolving ``inherit`` and ``initial`` values
+        - ``'font-size'``: resolving font size, including its conversion
+        - ``'size'``: converting a size to pt
+        - ``'warn'``: emitting a :class:`CSSWarning`
+
+        A phase's time includes that of any phases within it. Results served
+        from the cache, and work done in worker processes, are not counted.
+
+        Examples
+        --------
+        >>> resolver = CSS22Resolver(profile=True)
+        >>> _ = resolver.resolve_string('border: 1px solid red; '
+        ...                             'font-size: 2em')
+        >>> resolver.stats['expand:border']  # doctest: +ELLIPSIS
+        PhaseStats(calls=1, seconds=...)
+        >>> resolver.stats['size'].calls
+        5
+        """
+        if self._profiler is None:
+            return None
+        return self._profiler.snapshot()
+
+    def stats_clear(self):
+        """Reset the statistics reported in :attr:`stats`"""
+        if self._profiler is not None:
+            self._profiler.clear()
+
+    def _warn(self, code, prop, value, message):
+        if self.diagnostics is None:
+            warnings.warn(message, CSSWarning)
+        else:
+            self.diagnostics.record(Diagnostic(code, prop, value, message))
+
+    def resolve_string(self, declarations_str, inherited=None,
+                       properties=None):
+        """Resolve the given declarations to atomic properties
+
+        Parameters
+        ----------
+        declarations_str : str
+            A list of CSS declarations
+        inherited : dict, optional
+            Atomic properties indicating the inherited style context in which
+            declarations_str is to be resolved. ``inherited`` should already
+            be resolved, i.e. valid output of this method.
+        properties : set of str, optional
+            If given, only these atomic properties are output. Declarations
+            that cannot set any of them are skipped before their values are
+            expanded or converted, which saves work when few properties are
+            needed.
+
+        Returns
+        -------
+        props : dict
+            Atomic CSS 2.2 properties mapped to their values as strings
+
+        Examples
+        --------
+        >>> resolver = CSS22Resolver()
+        >>> inherited = {'font-family': 'serif', 'font-weight': 'bold'}
+        >>> out = resolver.resolve_string('''
+        ...               border-color: BLUE RED;
+        ...               font-size: 1em;
+        ...               font-size: 2em;
+        ...               font-weight: normal;
+        ...               font-weight: inherit;
+        ...               ''', inherited)
+        >>> sorted(out.items())  # doctest: +NORMALIZE_WHITESPACE
+        [('border-bottom-color', 'blue'),
+         ('border-left-color', 'red'),
+         ('border-right-color', 'red'),
+         ('border-top-color', 'blue'),
+         ('font-family', 'serif'),
+         ('font-size', '24pt'),
+         ('font-weight', 'bold')]
+        >>> resolver.resolve_string('border: 1px solid red; font-size: 2em; '
+        ...                         'margin: 1em 0',
+        ...                         properties={'margin-top', 'color'})
+        {'margin-top': '24pt'}
+        """
+        return self._resolve_cached(declarations_str, inherited, False,
+                                    properties=properties)
+
+    def resolve_typed(self, declarations_str, inherited=None,
+                      properties=None):
+        """Resolve declarations to atomic properties with typed values
+
+        Like :meth:`resolve_string`, but sizes are given as floats in pt, and
+        colors as :class:`tinycss2.color3.RGBA` tuples, where understood.
+
+        Parameters
+        ----------
+        declarations_str : str
+            A list of CSS declarations
+        inherited : dict, optional
+            Atomic properties indicating the inherited style context in which
+            declarations_str is to be resolved. ``inherited`` should already
+            be resolved, i.e. valid output of this method or of
+            :meth:`resolve_string`.
+        properties : set of str, optional
+            Atomic properties to output, as for :meth:`resolve_string`.
+
+        Returns
+        -------
+        props : dict
+            Atomic CSS 2.2 properties mapped to their values
+
+        Examples
+        --------
+        >>> resolver = CSS22Resolver()
+        >>> out = resolver.resolve_typed('font-size: 2em; color: #f008; '
+        ...                              'margin-top: .5em; font-weight: bold',
+        ...                              inherited={'font-size': 10.})
+        >>> sorted(out.items())  # doctest: +NORMALIZE_WHITESPACE +ELLIPSIS
+        [('color', RGBA(red=1.0, green=0.0, blue=0.0, alpha=0.533...)),
+         ('font-size', 20.0),
+         ('font-weight', 'bold'),
+         ('margin-top', 10.0)]
+        """
+        return self._resolve_cached(declarations_str, inherited, True,
+                                    properties=properties)
+
+    def resolve_style(self, declarations_str, inherited=None, typed=False,
+                      properties=None):
+        """Resolve declarations to a compact, immutable ComputedStyle
+
+        Parameters
+        ----------
+        declarations_str : str
+            A list of CSS declarations
+        inherited : dict or ComputedStyle, optional
+            Atomic properties indicating the inherited style context. See
+            :meth:`resolve_string`.
+        typed : bool, default False
+            Whether to output typed values as in :meth:`resolve_typed`.
+        properties : set of str, optional
+            Atomic properties to output, as for :meth:`resolve_string`.
+
+        Returns
+        -------
+        style : ComputedStyle
+
+        Examples
+        --------
+        >>> resolver = CSS22Resolver()
+        >>> row = resolver.resolve_style('font-size: 10pt; color: red')
+        >>> cell = resolver.resolve_style('font-size: 2em', row)
+        >>> cell
+        ComputedStyle({'color': 'red', 'font-size': '20pt'})
+        >>> cell == {'color': 'red', 'font-size': '20pt'}
+        True
+        """
+        return self._resolve_cached(declarations_str, inherited, typed,
+                                    as_style=True, properties=properties)
+
+    def update(self, resolved, declarations_str, inherited=None,
+               typed=False, base=None):
+        """Apply further declarations to an already resolved style
+
+        Only ``declarations_str`` is parsed, and only its properties are
+        resolved, together with those sizes in ``base`` which are relative
+        to a font size that ``declarations_str`` changes. Given ``base``,
+        this gives the same result as resolving ``base`` followed by
+        ``declarations_str``.
+
+        Without ``base``, the values in ``resolved`` are all taken as
+        computed, so sizes originally given in ``em`` keep their value when
+        ``declarations_str`` changes the font size.
+
+        Parameters
+        ----------
+        resolved : dict
+            Atomic properties, as output by :meth:`resolve_string` (or
+            :meth:`resolve_typed` if ``typed``) given ``inherited``.
+        declarations_str : str
+            A list of CSS declarations to apply.
+        inherited : dict, optional
+            The inherited context in which ``resolved`` was resolved, used
+            where ``declarations_str`` declares ``inherit`` or a font size
+            relative to the parent's.
+        typed : bool, default False
+            Whether values are typed, as output by :meth:`resolve_typed`.
+        base : str or CompiledDeclarations, optional
+            The declarations that were resolved to give ``resolved``, or
+            their compiled form from :meth:`compile`, which is cheaper to
+            reuse across many updates.
+
+        Returns
+        -------
+        props : dict
+            A new dict of atomic properties.
+
+        Examples
+        --------
+        >>> resolver = CSS22Resolver()
+        >>> base = resolver.resolve_string('font-size: 10pt; color: red')
+        >>> out = resolver.update(base, 'margin-top: 2em; color: blue')
+        >>> sorted(out.items())
+        [('color', 'blue'), ('font-size', '10pt'), ('margin-top', '20pt')]
+        >>> resolver.update(base, 'font-size: 2em; margin-top: 2em',
+        ...                 inherited={'font-size': '8pt'})['margin-top']
+        '32pt'
+
+        Sizes in ``em`` are only rescaled if ``base`` is given:
+
+        >>> base_str = 'font-size: 10pt; margin-top: 2em'
+        >>> base = resolver.resolve_string(base_str)
+        >>> resolver.update(base, 'font-size: 20pt')['margin-top']
+        '20pt'
+        >>> resolver.update(base, 'font-size: 20pt',
+        ...                 base=base_str)['margin-top']
+        '40pt'
+        """
+        compiled = self.compile(declarations_str)
+        if inherited is None:
+            inherited = {}
+        font_declared = (compiled._font_static
+                         or compiled._font_size is not None
+                         or 'font-size' in compiled._inherit
+                         or 'font-size' in compiled._removed)
+        if font_declared:
+            context = inherited
+        else:
+            # undeclared relative sizes are relative to the existing font
+            context = dict(inherited)
+            context.pop('font-size', None)
+            if resolved.get('font-size') is not None:
+                context['font-size'] = resolved['font-size']
 
-try:
-    import tinycss2
-    import tinycss2.color3
-except ImportError:
-    # currently needed for setup.cfg to get version :(
-    pass
+        props = dict(resolved)
+        for prop in compiled._removed:
+            props.pop(prop, None)
+        for prop in compiled._inherit:
+            if prop in inherited:
+                props[prop] = inherited[prop]
+            else:
+                # replaced by any initial value in _resolve_own
+                props.pop(prop, None)
+        own = self._resolve_own(compiled, context, typed)
+        props.update(own)
+        if font_declared and base is not None:
+            self._update_relative(props, base, compiled, own, context,
+                                  inherited, typed)
+        if typed:
+            self._type_values(props, inherited)
+        return props
 
-__version__ = '0.1.3+dev'
+    def _update_relative(self, props, base, compiled, own, context,
+                         inherited, typed):
+        """Rescale sizes in base relative to a changed font size
 
+        Sizes also declared in compiled are left as resolved from it.
+        """
+        if not isinstance(base, CompiledDeclarations):
+            base = self.compile(base)
+        if base._inherit:
+            _, relative = self._resolve_inherit(base, inherited, {})
+        else:
+            relative = base._relative
+        relative += base._em_static
+        if not relative:
+            return
+        declared = set(compiled._static)
+        declared.update(compiled._inherit)
+        declared.update(compiled._removed)
+        declared.update(prop for prop, _, _ in compiled._relative)
+        if 'font-size' in own:
+            font_pt = _font_size_pt(own)
+        else:
+            font_pt = _font_size_pt(context)
+        out_idx = 0 if typed else 1
+        for prop, val, conversions in relative:
+            if prop not in declared:
+                props[prop] = self._convert_size(
+                    val, em_pt=font_pt, conversions=conversions,
+                    prop=prop)[out_idx]
 
-__all__ = ['CSSWarning', 'CSS22Resolver']
+    def _resolve_cached(self, declarations_str, inherited, typed,
+                        as_style=False, cache=_DEFAULT, properties=None):
+        if properties is not None:
+            properties = frozenset(properties)
+        if cache is _DEFAULT:
+            cache = self._cache
+        if cache is None:
+            props = self._resolve(declarations_str, inherited, typed,
+                                  properties)
+            if as_style:
+                return ComputedStyle(props)
+            return props
 
+        key = (declarations_str, _freeze_inherited(inherited), typed,
+               as_style, properties)
+        props = cache.get(key)
+        if props is None:
+            props = self._resolve(declarations_str, inherited, typed,
+                                  properties)
+            if as_style:
+                props = ComputedStyle(props)
+            cache.set(key, props)
+        if as_style:
+            return props
+        # copy so that callers cannot modify the cached entry
+        return dict(props)
 
-class CSSWarning(UserWarning):
-    """Warning for when this CSS syntax cannot currently be parsed"""
-    pass
+    def resolve_many(self, declarations, inherited=None, typed=False,
+                     n_jobs=None, chunksize=None, backend='process',
+                     properties=None):
+        """Resolve many declaration blocks, resolving each distinct one once
 
+        Parameters
+        ----------
+        declarations : iterable
+            Each item is either a declarations string or a pair of
+            ``(declarations_str, inherited)``.
+        inherited : dict, optional
+            The inherited context for items given as plain strings.
+        typed : bool, default False
+            Whether to resolve with :meth:`resolve_typed` rather than
+            :meth:`resolve_string`.
+        n_jobs : int, optional
+            If greater than 1, distinct items are resolved in this many worker
+            processes using :class:`concurrent.futures.ProcessPoolExecutor`.
+            -1 means using all CPUs. This is only worthwhile for many
+            thousands of distinct items.
+        chunksize : int, optional
+            The number of distinct items sent to a worker at a time. By
+            default, each worker receives about four chunks.
+        backend : {'process', 'thread'}, default 'process'
+            With 'thread', ``n_jobs`` threads share this resolver using
+            :class:`concurrent.futures.ThreadPoolExecutor`. This avoids
+            copying the resolver and results between processes, but only
+            resolves in parallel on a free-threaded (no GIL) build of Python.
+        properties : set of str, optional
+            Atomic properties to output, as for :meth:`resolve_string`.
 
-def _clean_tokens(tokens):
-    cleaned = []
-    for tok in tokens:
-        if tok.type == 'comment' or tok.type == 'whitespace':
-            pass
-        elif tok.type == 'error':
-            # TODO: indicate error context (requires
-            warnings.warn('Error parsing CSS: %r' % tok.message,
-                          CSSWarning)
-        else:
-            cleaned.append(tok)
-    return cleaned
+        Returns
+        -------
+        resolved : list of dict
+            Atomic properties for each item, as output by
+            :meth:`resolve_string`, in input order. Items with identical
+            declarations and inherited context share the same dict object.
+
+        Examples
+        --------
+        >>> resolver = CSS22Resolver()
+        >>> out = resolver.resolve_many(['font-size: 2em', 'color: red',
+        ...                              ('font-size: 2em',
+        ...                               {'font-size': '10pt'}),
+        ...                              'font-size: 2em'])
+        >>> out  # doctest: +NORMALIZE_WHITESPACE
+        [{'font-size': '24pt'}, {'color': 'red'}, {'font-size': '20pt'},
+         {'font-size': '24pt'}]
+        >>> out[0] is out[3]
+        True
+        """
+        uniques, codes = _factorize(declarations, inherited)
+        resolved = self._resolve_uniques(uniques, typed, n_jobs, chunksize,
+                                         backend, properties)
+        return [resolved[code] for code in codes]
 
+    def resolve_ids(self, declarations, inherited=None, typed=False,
+                    registry=None, n_jobs=None, chunksize=None,
+                    backend='process', properties=None):
+        """Resolve many declaration blocks to ids in a StyleRegistry
 
-def match_color_token(token):
-    return tinycss2.color3.parse_color(token) is not None
+        Each distinct item is resolved once, as in :meth:`resolve_many`, and
+        its style interned in ``registry``. Only an id per item is returned,
+        which takes much less memory than a dict per item for many items.
 
+        Parameters
+        ----------
+        declarations : iterable
+            Each item is either a declarations string or a pair of
+            ``(declarations_str, inherited)``.
+        inherited : dict, optional
+            The inherited context for items given as plain strings.
+        typed : bool, default False
+            Whether to resolve with :meth:`resolve_typed` rather than
+            :meth:`resolve_string`.
+        registry : StyleRegistry, optional
+            The registry to add styles to, such as one shared by several
+            calls. By default, a new registry is created.
+        n_jobs, chunksize, backend
+            As for :meth:`resolve_many`.
+        properties : set of str, optional
+            Atomic properties to output, as for :meth:`resolve_string`.
 
-def match_size_token(token):
-    return (token.type == 'dimension' or token.type == 'percentage'
-            or (token.type == 'ident' and token.lower_value in {
-                'medium', 'thin', 'thick', 'smaller', 'larger', 'xx-small',
-                'x-small', 'small', 'medium', 'large', 'x-large', 'xx-large'}))
+        Returns
+        -------
+        ids : array.array of int
+            The id of each item's style in ``registry``, in input order.
+        registry : StyleRegistry
 
+        Examples
+        --------
+        >>> resolver = CSS22Resolver()
+        >>> ids, registry = resolver.resolve_ids(['color: red', 'color: blue',
+        ...                                       'color: red'])
+        >>> list(ids)
+        [0, 1, 0]
+        >>> registry[ids[2]]
+        ComputedStyle({'color': 'red'})
+        """
+        if registry is None:
+            registry = StyleRegistry()
+        uniques, codes = _factorize(declarations, inherited)
+        resolved = self._resolve_uniques(uniques, typed, n_jobs, chunksize,
+                                         backend, properties)
+        style_ids = [registry.intern(props) for props in resolved]
+        return array('l', [style_ids[code] for code in codes]), registry
 
-class IdentMatch:
-    def __init__(self, values):
-        assert not isinstance(values, str)
-        self.values = set(values)
+    def resolve_columns(self, declarations, inherited=None, typed=False,
+                        n_jobs=None, properties=None):
+        """Resolve an array of declaration blocks to a column per property
 
-    def __call__(self, token):
-        return token.type == 'ident' and token.lower_value in self.values
+        Each distinct block (with its inherited context) is resolved once,
+        and the results are spread over cells with array indexing. This
+        requires NumPy, and is faster where pandas is available.
 
+        Parameters
+        ----------
+        declarations : array-like, pandas.Series or pandas.DataFrame
+            Declaration strings. Missing values are treated as empty.
+        inherited : dict or array-like, optional
+            The inherited context, either for all cells, or for each cell as
+            an array-like of the same shape as ``declarations``, with None
+            where there is no inherited context.
+        typed : bool, default False
+            Whether to resolve with :meth:`resolve_typed` rather than
+            :meth:`resolve_string`. Columns whose values are all floats,
+            such as sizes, then have float dtype, with NaN where the
+            property is not set.
+        n_jobs : int, optional
+            The number of worker processes, as in :meth:`resolve_many`.
+        properties : set of str, optional
+            Atomic properties to output, as for :meth:`resolve_string`.
 
-match_inherit_initial = IdentMatch(['inherit', 'initial'])
+        Returns
+        -------
+        resolved : pandas.DataFrame or numpy structured array
+            For pandas input, a DataFrame with a column for each resolved
+            property. Its index is that of ``declarations``, or for a
+            DataFrame, a MultiIndex of (row, column) for each cell in
+            row-major order. Otherwise, a structured array of the same shape
+            as ``declarations`` with a field per property. Properties not
+            set for a cell are None (or NaN in float columns).
 
+        Examples
+        --------
+        >>> import pandas as pd
+        >>> resolver = CSS22Resolver()
+        >>> cells = pd.Series(['font-size: 2em', 'margin-top: 3px', None,
+        ...                    'font-size: 2em'])
+        >>> resolver.resolve_columns(cells, typed=True)
+           font-size  margin-top
+        0       24.0         NaN
+        1        NaN        2.25
+        2        NaN         NaN
+        3       24.0         NaN
+        """
+        import numpy as np
 
-def match_tokens(tokens, matchers, remainder):
-    cleaned = _clean_tokens(tokens)
-    if len(cleaned) == 1 and match_inherit_initial(cleaned[0]):
-        out = {remainder: cleaned}
-        for k in matchers:
-            out[k] = cleaned
-        return out
+        index = None
+        if hasattr(declarations, 'index'):
+            import pandas as pd
+            if hasattr(declarations, 'columns'):
+                index = pd.MultiIndex.from_product([declarations.index,
+                                                    declarations.columns])
+            else:
+                index = declarations.index
+        values = np.asarray(declarations, dtype=object)
+        shape = values.shape
+        uniques, codes = _factorize_array(values.ravel())
+        uniques = [value if isinstance(value, str) else ''
+                   for value in uniques]
 
-    out = defaultdict(list)
-    for tok in cleaned:
-        for k, matcher in matchers.items():
-            if matcher(tok):
-                out[k].append(tok)
-                break
-        else:
-            out[remainder].append(tok)
-    out.default_factory = None
-    return out
+        if inherited is not None and not isinstance(inherited, Mapping):
+            contexts = np.asarray(inherited, dtype=object)
+            if contexts.shape != shape:
+                raise ValueError('inherited has shape %r, but declarations '
+                                 'has shape %r' % (contexts.shape, shape))
+            frozen = np.empty(contexts.size, dtype=object)
+            for i, context in enumerate(contexts.ravel()):
+                frozen[i] = _freeze_inherited(context)
+            frozen_uniques, context_codes = _factorize_array(frozen)
+            n_contexts = len(frozen_uniques)
+            pairs, codes = np.unique(codes * n_contexts + context_codes,
+                                     return_inverse=True)
+            contexts = [dict(context) if isinstance(context, frozenset)
+                        else context for context in frozen_uniques]
+            uniques = [(uniques[pair // n_contexts],
+                        contexts[pair % n_contexts])
+                       for pair in pairs.tolist()]
+            inherited = None
+        resolved = self.resolve_many(uniques, inherited=inherited,
+                                     typed=typed, n_jobs=n_jobs,
+                                     properties=properties)
 
+        columns = OrderedDict()
+        for props in resolved:
+            for prop in props:
+                columns[prop] = None
+        for prop in columns:
+            column = [props.get(prop) for props in resolved]
+            if typed and all(isinstance(val, float)
+                             for val in column if val is not None):
+                column = np.array([np.nan if val is None else val
+                                   for val in column], dtype=float)
+            else:
+                # assigned one at a time, as values may be tuples
+                values = np.empty(len(column), dtype=object)
+                for i, val in enumerate(column):
+                    values[i] = val
+                column = values
+            columns[prop] = column[codes.ravel()]
 
-class _BaseCSSResolver(object):
-    """Base class for parsing and resolving CSS to atomic properties
+        if index is not None:
+            return pd.DataFrame(columns, index=index)
+        out = np.empty(len(codes), dtype=[(prop, column.dtype)
+                                          for prop, column in columns.items()])
+        for prop, column in columns.items():
+            out[prop] = column
+        return out.reshape(shape)
 
-    """
+    def resolve_iter(self, declarations, inherited=None, typed=False,
+                     buffer_size=1024, properties=None):
+        """Lazily resolve a stream of declaration blocks
 
-    def __init__(self, initial=None):
-        self.initial = initial or {}
+        Unlike :meth:`resolve_many`, items are consumed and results produced
+        one at a time, so that memory use is bounded however long the
+        stream.
 
-    def resolve_string(self, declarations_str, inherited=None):
-        """Resolve the given declarations to atomic properties
+        Parameters
+        ----------
+        declarations : iterable
+            Each item is either a declarations string or a pair of
+            ``(declarations_str, inherited)``, such as generated by
+            :func:`read_declarations`.
+        inherited : dict, optional
+            The inherited context for items given as plain strings.
+        typed : bool, default False
+            Whether to resolve with :meth:`resolve_typed` rather than
+            :meth:`resolve_string`.
+        buffer_size : int, default 1024
+            If this resolver was constructed without ``cache_size``, up to
+            this many recent distinct items are remembered so that repeats
+            are resolved once. Otherwise the resolver's cache is used.
+        properties : set of str, optional
+            Atomic properties to output, as for :meth:`resolve_string`.
+
+        Yields
+        ------
+        props : dict
+            Atomic properties for each item, in input order.
+
+        Examples
+        --------
+        >>> import io
+        >>> resolver = CSS22Resolver()
+        >>> stream = io.StringIO('font-size: 2em\\ncolor: red\\n')
+        >>> for props in resolver.resolve_iter(read_declarations(stream)):
+        ...     print(props)
+        {'font-size': '24pt'}
+        {'color': 'red'}
+        """
+        cache = self._cache
+        if cache is None and buffer_size:
+            cache = _LRUCache(buffer_size)
+        for item in declarations:
+            if isinstance(item, str):
+                context = inherited
+            else:
+                item, context = item
+            yield self._resolve_cached(item, context, typed, cache=cache,
+                                       properties=properties)
+
+    def aresolve_many(self, declarations, inherited=None, typed=False,
+                      chunksize=256, executor=None, properties=None):
+        """Resolve many declaration blocks without blocking an event loop
+
+        Like :meth:`resolve_many`, each distinct item across all of
+        ``declarations`` is resolved once, but distinct items are resolved
+        ``chunksize`` at a time, returning control to the :mod:`asyncio`
+        event loop between chunks so that other tasks are not held up by a
+        large request.
+
+        Parameters
+        ----------
+        declarations : iterable
+            Each item is either a declarations string or a pair of
+            ``(declarations_str, inherited)``.
+        inherited : dict, optional
+            The inherited context for items given as plain strings.
+        typed : bool, default False
+            Whether to resolve with :meth:`resolve_typed` rather than
+            :meth:`resolve_string`.
+        chunksize : int, default 256
+            The number of distinct items resolved at a time.
+        executor : concurrent.futures.Executor, optional
+            If given, each chunk is resolved in this executor rather than in
+            the event loop's thread. A
+            :class:`~concurrent.futures.ThreadPoolExecutor` shares this
+            resolver and its cache; with a
+            :class:`~concurrent.futures.ProcessPoolExecutor`, the resolver is
+            copied to workers and their diagnostics merged back.
+        properties : set of str, optional
+            Atomic properties to output, as for :meth:`resolve_string`.
+
+        Returns
+        -------
+        future : asyncio.Future
+            To be awaited from within a running event loop. Its result is as
+            returned by :meth:`resolve_many`.
+
+        Examples
+        --------
+        >>> import asyncio
+        >>> resolver = CSS22Resolver()
+        >>> async def main():
+        ...     return await resolver.aresolve_many(['font-size: 2em',
+        ...                                          'color: red',
+        ...                                          'font-size: 2em'])
+        >>> asyncio.run(main())
+        [{'font-size': '24pt'}, {'color': 'red'}, {'font-size': '24pt'}]
+        """
+        if chunksize < 1:
+            raise ValueError('chunksize must be at least 1, got %r'
+                             % (chunksize,))
+        loop = _get_loop()
+        uniques, codes = _factorize(declarations, inherited)
+        future = loop.create_future()
+        resolved = []
+
+        def next_chunk(done=None):
+            if future.cancelled():
+                return
+            if done is not None:
+                if done.cancelled():
+                    future.cancel()
+                    return
+                if done.exception() is not None:
+                    future.set_exception(done.exception())
+                    return
+                resolved.extend(done.result())
+            if len(resolved) == len(uniques):
+                future.set_result([resolved[code] for code in codes])
+                return
+            chunk = uniques[len(resolved):len(resolved) + chunksize]
+            _resolve_chunk_async(loop, self, chunk, typed, executor,
+                                 properties).add_done_callback(next_chunk)
+
+        next_chunk()
+        return future
+
+    def aresolve_iter(self, declarations, inherited=None, typed=False,
+                      chunksize=256, executor=None, properties=None):
+        """Asynchronously iterate over resolved declaration blocks
+
+        Items are consumed ``chunksize`` at a time, and the distinct items in
+        each chunk not already seen in this iteration are resolved as in
+        :meth:`aresolve_many`. Results are then produced from the chunk
+        before the next is read.
+
+        Parameters
+        ----------
+        declarations : iterable
+            Each item is either a declarations string or a pair of
+            ``(declarations_str, inherited)``, such as generated by
+            :func:`read_declarations`.
+        inherited : dict, optional
+            The inherited context for items given as plain strings.
+        typed : bool, default False
+            Whether to resolve with :meth:`resolve_typed` rather than
+            :meth:`resolve_string`.
+        chunksize : int, default 256
+            The number of items read, and at most the number resolved, at a
+            time.
+        executor : concurrent.futures.Executor, optional
+            As for :meth:`aresolve_many`.
+        properties : set of str, optional
+            Atomic properties to output, as for :meth:`resolve_string`.
+
+        Returns
+        -------
+        iterator : asynchronous iterator
+            For use with ``async for`` within a running event loop, yielding
+            atomic properties for each item in input order. As for
+            :meth:`resolve_many`, items with identical declarations and
+            inherited context share the same dict object, which means every
+            distinct item is retained until the iteration ends.
+
+        Examples
+        --------
+        >>> import asyncio
+        >>> resolver = CSS22Resolver()
+        >>> async def main():
+        ...     async for props in resolver.aresolve_iter(['font-size: 2em',
+        ...                                                'color: red']):
+        ...         print(props)
+        >>> asyncio.run(main())
+        {'font-size': '24pt'}
+        {'color': 'red'}
+        """
+        if chunksize < 1:
+            raise ValueError('chunksize must be at least 1, got %r'
+                             % (chunksize,))
+        return _AsyncResolveIterator(self, declarations, inherited, typed,
+                                     chunksize, executor, properties)
+
+    def _resolve_uniques(self, uniques, typed, n_jobs, chunksize, backend,
+                         properties=None):
+        if backend not in ('process', 'thread'):
+            raise ValueError('backend must be "process" or "thread", got %r'
+                             % (backend,))
+        if n_jobs == -1:
+            n_jobs = os.cpu_count() or 1
+        if n_jobs is None or n_jobs <= 1 or len(uniques) <= 1:
+            return _resolve_chunk(self, uniques, typed, properties)
+        elif backend == 'thread':
+            return self._resolve_threaded(uniques, typed, n_jobs, chunksize,
+                                          properties)
+        return self._resolve_parallel(uniques, typed, n_jobs, chunksize,
+                                      properties)
+
+    @staticmethod
+    def _chunk(uniques, n_jobs, chunksize):
+        if chunksize is None:
+            chunksize = -(-len(uniques) // (n_jobs * 4))
+        return [uniques[i:i + chunksize]
+                for i in range(0, len(uniques), chunksize)]
+
+    def _resolve_threaded(self, uniques, typed, n_jobs, chunksize,
+                          properties=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        chunks = self._chunk(uniques, n_jobs, chunksize)
+        resolved = []
+        with ThreadPoolExecutor(min(n_jobs, len(chunks))) as executor:
+            for chunk_out in executor.map(partial(_resolve_chunk, self,
+                                                  typed=typed,
+                                                  properties=properties),
+                                          chunks):
+                resolved.extend(chunk_out)
+        return resolved
+
+    def _resolve_parallel(self, uniques, typed, n_jobs, chunksize,
+                          properties=None):
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunks = self._chunk(uniques, n_jobs, chunksize)
+        n_jobs = min(n_jobs, len(chunks))
+        resolved = []
+        with ProcessPoolExecutor(n_jobs) as executor:
+            for chunk_out, diagnostics in executor.map(
+                    partial(_resolve_chunk_remote, self, typed=typed,
+                            properties=properties),
+                    chunks):
+                resolved.extend(chunk_out)
+                if diagnostics:
+                    self.diagnostics.update(diagnostics)
+        return resolved
+
+    def __getstate__(self):
+        # caches are not worth pickling, e.g. to send to worker processes
+        state = self.__dict__.copy()
+        state['_cache'] = None
+        # nor is profiling, whose timed methods are closures
+        state['_profiler'] = None
+        _Profiler.uninstall(state)
+        if self.diagnostics is not None:
+            # a copy collects afresh, e.g. to be merged back from a worker
+            state['diagnostics'] = Diagnostics()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = self._make_cache()
+
+    def _make_cache(self):
+        memory = _LRUCache(self.cache_size) if self.cache_size else None
+        if self.cache_path is None:
+            return memory
+        return _PersistentCache(self.cache_path, self._cache_namespace(),
+                                memory)
+
+    def _cache_namespace(self):
+        """Identify what determines resolution, besides the input"""
+        cls = type(self)
+        tables = sorted((prop, sorted(table.items()))
+                        for prop, table in self._get_size_tables().items())
+        expanders = sorted((prop, getattr(expand, '__module__', None),
+                            getattr(expand, '__name__', None))
+                           for prop, expand in cls._get_expanders().items())
+        text = repr(('%s.%s' % (cls.__module__, cls.__name__),
+                     sorted(self.initial.items()), self.color_format,
+                     self.COLOR_PROPERTIES, tables, expanders))
+        return _hashlib.sha256(text.encode('utf8')).hexdigest()
+
+    def compile(self, declarations_str, properties=None):
+        """Parse and expand declarations for resolution in many contexts
 
         Parameters
         ----------
         declarations_str : str
             A list of CSS declarations
+        properties : set of str, optional
+            Atomic properties to output, as for :meth:`resolve_string`.
+
+        Returns
+        -------
+        compiled : CompiledDeclarations
+            Resolve this in an inherited context with its ``resolve``
+            method, which gives the same result as :meth:`resolve_string`.
+
+        Examples
+        --------
+        >>> resolver = CSS22Resolver()
+        >>> compiled = resolver.compile('font-size: 2em; color: red')
+        >>> compiled.resolve()  # doctest: +SKIP
+        {'font-size': '24pt', 'color': 'red'}
+        >>> compiled.resolve({'font-size': '10pt'})['font-size']
+        '20pt'
+        >>> sorted(compiled.context_dependent)
+        ['font-size']
+        """
+        props = {}
+        inherit = []
+        removed = []
+        initial = self.initial
+        needed = keep = None
+        if properties is not None:
+            properties = needed = frozenset(properties)
+            if ('font-size' not in needed
+                    and not needed.isdisjoint(self._get_size_tables())):
+                # sizes may be relative to the font size
+                needed = needed | frozenset(['font-size'])
+            keep = self._declaration_filter(needed)
+        for prop, tokens in self._atomize(self._parse(declarations_str, keep),
+                                          needed):
+            props[prop] = tokens
+        for prop, tokens in list(props.items()):
+            if isinstance(tokens, str):
+                # from an expander written for string values
+                val = tokens.strip().lower()
+            else:
+                val = _serialize(tokens)
+            if val == 'inherit':
+                inherit.append(prop)
+                del props[prop]
+                continue
+            if val == 'initial':
+                val = initial.get(prop)
+                if val is None:
+                    # we do not define a complete initial stylesheet
+                    removed.append(prop)
+                    del props[prop]
+                    continue
+            props[prop] = val
+
+        static = props
+        static_sizes = {}
+        if self.color_format is not None:
+            for prop in self.COLOR_PROPERTIES:
+                if prop in static:
+                    static[prop] = _format_color(static[prop],
+                                                 self.color_format)
+        relative = []
+        em_static = []
+        size_tables = self._get_size_tables()
+
+        # font size first, as other sizes may be relative to it
+        font_size = None
+        font_pt = None
+        font_static = 'font-size' in props
+        val = props.get('font-size')
+        if val:
+            conversions = size_tables['font-size']
+            if _get_size_converter(conversions).is_em_relative(val):
+                font_size = val
+                font_static = False
+                del static['font-size']
+            else:
+                font_pt, static['font-size'] = self._convert_size(
+                    val, conversions=conversions, prop='font-size')
+                static_sizes['font-size'] = font_pt
+
+        for prop, val in list(static.items()):
+            conversions = size_tables.get(prop)
+            if conversions is None or prop == 'font-size':
+                continue
+            converter = _get_size_converter(conversions)
+            em_relative = converter.is_em_relative(val)
+            if font_static or not em_relative:
+                static_sizes[prop], static[prop] = self._convert_size(
+                    val, em_pt=font_pt, conversions=conversions, prop=prop)
+                if em_relative:
+                    em_static.append((prop, val, conversions))
+            else:
+                relative.append((prop, val, conversions))
+                del static[prop]
+
+        return CompiledDeclarations(self, declarations_str, static,
+                                    static_sizes, font_size, font_pt,
+                                    font_static, tuple(inherit),
+                                    tuple(removed), tuple(relative),
+                                    tuple(em_static), properties)
+
+    def _resolve(self, declarations_str, inherited=None, typed=False,
+                 properties=None):
+        return self._resolve_compiled(self.compile(declarations_str,
+                                                   properties),
+                                      inherited, typed)
+
+    def resolve_tree(self, tree, inherited=None, typed=False):
+        """Resolve a hierarchy of declaration blocks in one pass
+
+        Each node's computed style is resolved in the context of its
+        parent's, and is a read-only :class:`LayeredStyle` which shares its
+        parent's entries rather than copying them. Nodes without
+        declarations share their parent's style object, as do siblings with
+        identical declarations.
+
+        Parameters
+        ----------
+        tree : tuple
+            The root node, as a pair ``(declarations_str, children)`` where
+            ``children`` is a list of nodes of the same form.
         inherited : dict, optional
-            Atomic properties indicating the inherited style context in which
-            declarations_str is to be resolved. ``inherited`` should already
-            be resolved, i.e. valid output of this method.
+            Atomic properties indicating the inherited style context of the
+            root. See :meth:`resolve_string`.
+        typed : bool, default False
+            Whether to output typed values as in :meth:`resolve_typed`.
 
         Returns
         -------
-        props : dict
-            Atomic CSS 2.2 properties mapped to their values as strings
+        resolved : tuple
+            A pair ``(style, children)`` mirroring ``tree``, where ``style``
+            is a :class:`LayeredStyle`.
 
         Examples
         --------
         >>> resolver = CSS22Resolver()
-        >>> inherited = {'font-family': 'serif', 'font-weight': 'bold'}
-        >>> out = resolver.resolve_string('''
-        ...               border-color: BLUE RED;
-        ...               font-size: 1em;
-        ...               font-size: 2em;
-        ...               font-weight: normal;
-        ...               font-weight: inherit;
-        ...               ''', inherited)
-        >>> sorted(out.items())  # doctest: +NORMALIZE_WHITESPACE
-        [('border-bottom-color', 'blue'),
-         ('border-left-color', 'red'),
-         ('border-right-color', 'red'),
-         ('border-top-color', 'blue'),
-         ('font-family', 'serif'),
-         ('font-size', '24pt'),
-         ('font-weight', 'bold')]
+        >>> sheet = ('font-size: 10pt; color: red', [
+        ...     ('font-weight: bold', [('font-size: 2em', []),
+        ...                            ('', [])]),
+        ... ])
+        >>> sheet_style, [(row_style, cells)] = resolver.resolve_tree(sheet)
+        >>> dict(cells[0][0]) == {'font-size': '20pt', 'color': 'red',
+        ...                       'font-weight': 'bold'}
+        True
+        >>> cells[1][0] is row_style
+        True
         """
+        compiled_cache = {}
 
-        props = dict(self._atomize(self._parse(declarations_str)))
-        if inherited is None:
-            inherited = {}
+        def compile(declarations_str):
+            compiled = compiled_cache.get(declarations_str)
+            if compiled is None:
+                compiled = compiled_cache[declarations_str] = self.compile(
+                    declarations_str)
+            return compiled
+
+        declarations_str, children = tree
+        root = LayeredStyle(self._resolve_compiled(compile(declarations_str),
+                                                   inherited, typed))
+        out = (root, [])
+        stack = [(children, root, out[1])]
+        while stack:
+            children, parent, out_children = stack.pop()
+            # siblings commonly share declarations
+            memo = {}
+            for declarations_str, grandchildren in children:
+                try:
+                    style = memo[declarations_str]
+                except KeyError:
+                    style = memo[declarations_str] = self._resolve_layer(
+                        compile(declarations_str), parent, typed)
+                node_out = (style, [])
+                out_children.append(node_out)
+                if grandchildren:
+                    stack.append((grandchildren, style, node_out[1]))
+        return out
+
+    def _resolve_layer(self, compiled, parent, typed=False):
+        own = self._resolve_own(compiled, parent, typed)
+        if typed and compiled._inherit:
+            # initial values may be strings
+            self._type_values(own, parent)
+        for prop in compiled._removed:
+            if prop in parent:
+                own[prop] = _REMOVED
+        if not own:
+            return parent
+        return LayeredStyle(own, parent)
+
+    def _resolve_compiled(self, compiled, inherited=None, typed=False):
+        if not inherited:
+            props = self._resolve_own(compiled, {}, typed)
+        else:
+            props = dict(inherited)
+            props.update(self._resolve_own(compiled, inherited, typed))
+            for prop in compiled._removed:
+                props.pop(prop, None)
+
+        if typed:
+            # inherited and initial values may be strings
+            self._type_values(props, inherited)
+        properties = compiled._properties
+        if properties is not None:
+            props = dict((prop, val) for prop, val in props.items()
+                         if prop in properties)
+        return props
+
+    def _resolve_own(self, compiled, inherited, typed=False):
+        """Resolve declared properties given the inherited context
+
+        Values inherited unchanged are not included.
+        """
+        # sizes are output as float (typed) or str
+        out_idx = 0 if typed else 1
+        if typed:
+            props = dict(compiled._get_typed_static())
+        else:
+            props = dict(compiled._static)
 
         # 1. resolve inherited, initial
-        for prop, val in inherited.items():
-            if prop not in props:
-                props[prop] = val
+        if compiled._inherit:
+            font_size, relative = self._resolve_inherit(compiled, inherited,
+                                                        props)
+        else:
+            font_size = compiled._font_size
+            relative = compiled._relative
 
-        for prop, val in list(props.items()):
-            if val == 'inherit':
-                val = inherited.get(prop, 'initial')
-            if val == 'initial':
-                val = self.initial.get(prop)
+        # 2. resolve relative font size
+        font_pt = self._resolve_font_size(compiled, font_size, inherited,
+                                          props, out_idx)
+
+        # 3. TODO: resolve other font-relative units
+        for prop, val, conversions in relative:
+            # TODO: support % for margin and padding
+            props[prop] = self._convert_size(
+                val, em_pt=font_pt, conversions=conversions,
+                prop=prop)[out_idx]
+        return props
 
+    def _resolve_inherit(self, compiled, inherited, props):
+        """Resolve properties declared inherit, without an inherited value
+
+        Initial values are set in props, except for sizes, which are
+        returned as (font_size, relative) to be resolved with the others.
+        """
+        size_tables = self._get_size_tables()
+        font_size = compiled._font_size
+        relative = compiled._relative
+        initial = self.initial
+        for prop in compiled._inherit:
+            if prop in inherited:
+                continue
+            val = initial.get(prop)
             if val is None:
                 # we do not define a complete initial stylesheet
-                del props[prop]
+                continue
+            if prop == 'font-size':
+                font_size = val
+            elif prop in size_tables:
+                relative += ((prop, val, size_tables[prop]),)
             else:
                 props[prop] = val
+        return font_size, relative
 
-        # 2. resolve relative font size
-        if props.get('font-size'):
-            if 'font-size' in inherited:
-                em_pt = inherited['font-size']
-                assert em_pt[-2:] == 'pt'
-                em_pt = float(em_pt[:-2])
-            else:
-                em_pt = None
-            props['font-size'] = self._size_to_pt(
-                props['font-size'], em_pt, conversions=self.FONT_SIZE_RATIOS)
+    def _resolve_font_size(self, compiled, font_size, inherited, props,
+                           out_idx):
+        """Set any relative font-size in props and return the font size in pt
+        """
+        em_pt = _font_size_pt(inherited)
+        if font_size is not None:
+            sizes = self._convert_size(
+                font_size, em_pt,
+                conversions=self._get_size_tables()['font-size'],
+                prop='font-size')
+            props['font-size'] = sizes[out_idx]
+            return sizes[0]
+        elif compiled._font_static:
+            return compiled._font_pt
+        return em_pt
 
-            font_size = float(props['font-size'][:-2])
-        else:
+    def _type_values(self, props, inherited):
+        """Convert any sizes and colors in props still given as strings"""
+        size_tables = self._get_size_tables()
+        font_size = props.get('font-size')
+        if font_size == '':
             font_size = None
+        elif isinstance(font_size, str):
+            font_size = props['font-size'] = self._convert_size(
+                font_size, _font_size_pt(inherited),
+                conversions=size_tables['font-size'], prop='font-size')[0]
+        for prop, conversions in size_tables.items():
+            val = props.get(prop)
+            if isinstance(val, str) and val:
+                props[prop] = self._convert_size(
+                    val, font_size, conversions=conversions, prop=prop)[0]
+        for prop in self.COLOR_PROPERTIES:
+            val = props.get(prop)
+            if isinstance(val, str):
+                props[prop] = _parse_color_value(val)
 
-        # 3. TODO: resolve other font-relative units
-        for side in self.SIDES:
-            prop = 'border-%s-width' % side
-            if prop in props:
-                props[prop] = self._size_to_pt(
-                    props[prop], em_pt=font_size,
-                    conversions=self.BORDER_WIDTH_RATIOS)
-            for prop in ['margin-%s' % side, 'padding-%s' % side]:
-                if prop in props:
-                    # TODO: support %
-                    props[prop] = self._size_to_pt(
-                        props[prop], em_pt=font_size,
-                        conversions=self.MARGIN_RATIOS)
+    @classmethod
+    def _get_size_tables(cls):
+        """Map each property with a size value to its table of unit ratios
+        """
+        try:
+            return cls.__dict__['_size_tables']
+        except KeyError:
+            pass
+        size_tables = {'font-size': cls.FONT_SIZE_RATIOS}
+        for side in cls.SIDES:
+            size_tables['border-%s-width' % side] = cls.BORDER_WIDTH_RATIOS
+            size_tables['margin-%s' % side] = cls.MARGIN_RATIOS
+            size_tables['padding-%s' % side] = cls.MARGIN_RATIOS
+        cls._size_tables = size_tables
+        return size_tables
 
-        return props
+    COLOR_PROPERTIES = ['color', 'background-color', 'outline-color',
+                        'border-top-color', 'border-right-color',
+                        'border-bottom-color', 'border-left-color']
 
     UNIT_RATIOS = {
         'rem': ('pt', 12),
@@ -222,67 +3038,187 @@ class _BaseCSSResolver(object):
     })
 
     def _size_to_pt(self, in_val, em_pt=None, conversions=UNIT_RATIOS):
-        def _error():
-            warnings.warn('Unhandled size: %r' % in_val, CSSWarning)
-            return self._size_to_pt('1!!default', conversions=conversions)
+        return self._convert_size(in_val, em_pt, conversions)[1]
 
+    def _convert_size(self, in_val, em_pt=None, conversions=UNIT_RATIOS,
+                      prop=None):
+        """Convert a size string to a pair of (float pt, formatted pt)"""
+        converter = _get_size_converter(conversions)
+        memo = converter.memo
+        key = (in_val, em_pt)
         try:
-            val, unit = re.match(r'^(\S*?)([a-zA-Z%!].*)', in_val).groups()
-        except AttributeError:
-            return _error()
-        if val == '':
-            # hack for 'large' etc.
-            val = 1
-        else:
-            try:
-                val = float(val)
-            except ValueError:
-                return _error()
-
-        while unit != 'pt':
-            if unit == 'em':
-                if em_pt is None:
-                    unit = 'rem'
-                else:
-                    val *= em_pt
-                    unit = 'pt'
-                continue
+            return memo[key]
+        except KeyError:
+            pass
 
-            try:
-                unit, mul = conversions[unit]
-            except KeyError:
-                return _error()
-            val *= mul
+        val = converter.to_pt(in_val, em_pt)
+        if val is None:
+            self._warn('unhandled-size', prop, in_val,
+                       'Unhandled size: %r' % in_val)
+            return self._convert_size('1!!default', conversions=conversions)
 
         val = round(val, 5)
         if int(val) == val:
             size_fmt = '%d'
         else:
             size_fmt = '%f'
-        return (size_fmt + 'pt') % val
+        out = (float(val), (size_fmt + 'pt') % val)
+        if len(memo) >= _SIZE_MEMO_SIZE:
+            memo.clear()
+        memo[key] = out
+        return out
+
+    @classmethod
+    def register_expander(cls, prop, expander=None):
+        """Register a function to expand a shorthand property
+
+        This applies to instances of this class and its subclasses. It takes
+        precedence over any ``expand_*`` method or entry in
+        ``SHORTHAND_GRAMMARS`` for ``prop`` defined on this class or its
+        bases, but not over one defined on a subclass. On each class, an
+        ``expand_*`` method takes precedence over a grammar.
+
+        Most shorthands can instead be described declaratively, with a
+        :class:`ComponentGrammar` or :class:`SideGrammar` in a subclass's
+        ``SHORTHAND_GRAMMARS`` dict, which is merged with those of its bases.
+
+        Parameters
+        ----------
+        prop : str
+            Lowercase property name, e.g. ``'border-top'``
+        expander : callable, optional
+            Called as ``expander(resolver, prop, value)`` where ``value`` is a
+            list of tinycss2 component values, and generating (prop, value)
+            pairs with values in the same form, or as strings. If not given,
+            returns a decorator. It may have an ``expanded_properties``
+            method, called with the resolver's ``SIDES`` and returning the
+            atomic properties it may generate, so that it can be skipped when
+            resolving only other ``properties``.
+
+        Examples
+        --------
+        >>> class MyResolver(CSS22Resolver):
+        ...     pass
+        >>> @MyResolver.register_expander('text-decoration')
+        ... def expand_text_decoration(resolver, prop, value):
+        ...     yield 'text-decoration-line', value
+        >>> MyResolver().resolve_string('text-decoration: underline')
+        {'text-decoration-line': 'underline'}
+        """
+        if expander is None:
+            def decorator(expander):
+                cls.register_expander(prop, expander)
+                return expander
+            return decorator
+
+        if '_registered_expanders' not in cls.__dict__:
+            cls._registered_expanders = {}
+        cls._registered_expanders[prop] = expander
+
+        # invalidate registries already built
+        stack = [cls]
+        while stack:
+            klass = stack.pop()
+            for attr in ('_expanders', '_expansions'):
+                if attr in klass.__dict__:
+                    delattr(klass, attr)
+            stack.extend(klass.__subclasses__())
+        return expander
+
+    @classmethod
+    def _get_expanders(cls):
+        """Map each shorthand property to its expander, built once per class
+        """
+        try:
+            return cls.__dict__['_expanders']
+        except KeyError:
+            pass
+
+        expanders = {}
+        for klass in reversed(cls.__mro__):
+            grammars = vars(klass).get('SHORTHAND_GRAMMARS', {})
+            for prop, grammar in grammars.items():
+                expanders[prop] = grammar.compile()
+            for name, attr in vars(klass).items():
+                if name.startswith('expand_') and callable(attr):
+                    expanders[name[len('expand_'):].replace('_', '-')] = attr
+            expanders.update(vars(klass).get('_registered_expanders', {}))
+        cls._expanders = expanders
+        return expanders
 
-    def _atomize(self, declarations):
+    def _atomize(self, declarations, properties=None):
+        expanders = self._get_expanders()
         for prop, value in declarations:
-            attr = 'expand_' + prop.replace('-', '_')
-            try:
-                expand = getattr(self, attr)
-            except AttributeError:
+            expand = expanders.get(prop)
+            if expand is None:
                 yield prop, value
-            else:
-                for prop, value in expand(prop, value):
-                    yield prop, value
+                continue
+            try:
+                expanded = expand(self, prop, value)
+                for name, tokens in expanded:
+                    if properties is None or name in properties:
+                        yield name, tokens
+            except AttributeError as exc:
+                raise TypeError(
+                    'Expander %s for %r failed with AttributeError: %s. '
+                    'Expanders are passed values as lists of tinycss2 '
+                    'component values, not strings, though they may '
+                    'generate either.'
+                    % (getattr(expand, '__name__', repr(expand)), prop, exc))
+
+    @classmethod
+    def _get_expansions(cls):
+        """Map each shorthand property to the atomic properties it may set
+
+        Shorthands whose expander does not say are mapped to None.
+        """
+        try:
+            return cls.__dict__['_expansions']
+        except KeyError:
+            pass
+        expansions = {}
+        for prop, expand in cls._get_expanders().items():
+            get_properties = getattr(expand, 'expanded_properties', None)
+            expansions[prop] = (None if get_properties is None
+                                else frozenset(get_properties(cls.SIDES)))
+        cls._expansions = expansions
+        return expansions
+
+    def _declaration_filter(self, properties):
+        """Whether to keep a declaration, given the atomic properties needed
+        """
+        expansions = self._get_expansions()
+
+        def keep(prop):
+            if prop in properties:
+                return True
+            if prop not in expansions:
+                return False
+            expanded = expansions[prop]
+            return expanded is None or not properties.isdisjoint(expanded)
 
-    def _parse(self, declarations_str):
+        return keep
+
+    def _parse(self, declarations_str, keep=None):
         """Generates (prop, value) pairs from declarations
 
-        In a future version may generate parsed tokens from tinycss/tinycss2
+        Each value is a list of tinycss2 component values, which is
+        serialized only once the value is atomic. If given, ``keep`` is
+        called with each property name, and declarations it rejects are
+        dropped.
         """
+        decls = _scan_declarations(declarations_str, keep)
+        if decls is not None:
+            return iter(decls)
+        return self._parse_tinycss2(declarations_str, keep)
+
+    def _parse_tinycss2(self, declarations_str, keep=None):
         decls = tinycss2.parse_declaration_list(declarations_str,
                                                 skip_comments=True)
-        decls = _clean_tokens(decls)
+        decls = _clean_tokens(decls, self._warn)
         for decl in decls:
-            value_str = tinycss2.serialize(decl.value).strip().lower()
-            yield decl.lower_name, value_str
+            if keep is None or keep(decl.lower_name):
+                yield decl.lower_name, decl.value
 
 
 class _CommonExpansions(object):
@@ -294,56 +3230,110 @@ class _CommonExpansions(object):
     }
     SIDES = ('top', 'right', 'bottom', 'left')
 
-    def _side_expander(prop_fmt):
-        def expand(self, prop, value):
-            tokens = _clean_tokens(tinycss2.parse_component_value_list(value))
-            try:
-                mapping = self.SIDE_SHORTHANDS[len(tokens)]
-            except KeyError:
-                warnings.warn('Could not expand "%s: %s"' % (prop, value),
-                              CSSWarning)
-                return
-            for key, idx in zip(self.SIDES, mapping):
-                yield prop_fmt % key, tinycss2.serialize(tokens[idx:idx + 1])
-
-        return expand
+    _BORDER = [
+        Component('border-{side}-width', types=['dimension', 'percentage'],
+                  keywords=_SIZE_KEYWORDS, multiple=True),
+        Component('border-{side}-style', remainder=True),
+        Component('border-{side}-color', types=['hash', 'function', 'ident'],
+                  match=match_color_token, multiple=True),
+    ]
 
-    expand_border_color = _side_expander('border-%s-color')
-    expand_border_style = _side_expander('border-%s-style')
-    expand_border_width = _side_expander('border-%s-width')
-    expand_margin = _side_expander('margin-%s')
-    expand_padding = _side_expander('padding-%s')
-
-    def expand_border(self, prop, value, side=None):
-        if side is None:
-            sides = ['top', 'right', 'bottom', 'left']
-        else:
-            sides = [side]
-
-        # TODO: clean tokens?
-        value = tinycss2.parse_component_value_list(value)
-        matched = match_tokens(value,
-                               {'width': match_size_token,
-                                'color': match_color_token},
-                               remainder='style')
-        for side in sides:
-            for k, v in matched.items():
-                if v:
-                    v = _clean_tokens(v)
-                    yield 'border-%s-%s' % (side, k), tinycss2.serialize(v)
-
-    def _border_side_expander(side):
-        # XXX: functools.partial cannot be bound!
-        def expand_border_side(self, prop, value):
-            return self.expand_border(prop, value, side)
-        return expand_border_side
-
-    expand_border_top = _border_side_expander('top')
-    expand_border_right = _border_side_expander('right')
-    expand_border_bottom = _border_side_expander('bottom')
-    expand_border_left = _border_side_expander('left')
+    SHORTHAND_GRAMMARS = {
+        'border-color': SideGrammar('border-{side}-color'),
+        'border-style': SideGrammar('border-{side}-style'),
+        'border-width': SideGrammar('border-{side}-width'),
+        'margin': SideGrammar('margin-{side}'),
+        'padding': SideGrammar('padding-{side}'),
+        'border': ComponentGrammar(_BORDER, sides=SIDES),
+        'border-top': ComponentGrammar(_BORDER, sides=['top']),
+        'border-right': ComponentGrammar(_BORDER, sides=['right']),
+        'border-bottom': ComponentGrammar(_BORDER, sides=['bottom']),
+        'border-left': ComponentGrammar(_BORDER, sides=['left']),
+        'font': ComponentGrammar([
+            Component('font-style', keywords=['normal', 'italic', 'oblique']),
+            Component('font-variant', keywords=['normal', 'small-caps']),
+            Component('font-weight',
+                      keywords=['normal', 'bold', 'bolder', 'lighter'],
+                      types=['number'], match=_match_font_weight),
+            Component('font-size', types=['dimension', 'percentage'],
+                      keywords=_SIZE_KEYWORDS - {'thin', 'thick'}, stage=1,
+                      required=True),
+            Component('line-height',
+                      types=['number', 'dimension', 'percentage'],
+                      keywords=['normal'], stage=2, prefix='/'),
+            Component('font-family', stage=3, rest=True, required=True),
+        ]),
+        'background': ComponentGrammar([
+            Component('background-color',
+                      types=['hash', 'function', 'ident'],
+                      match=match_color_token),
+            Component('background-image', types=['url', 'function'],
+                      keywords=['none'], match=_match_image),
+            Component('background-repeat',
+                      keywords=['repeat', 'repeat-x', 'repeat-y',
+                                'no-repeat']),
+            Component('background-attachment', keywords=['scroll', 'fixed']),
+            Component('background-position',
+                      types=['dimension', 'percentage', 'number'],
+                      keywords=['left', 'center', 'right', 'top', 'bottom'],
+                      multiple=True),
+        ]),
+    }
 
 
 class CSS22Resolver(_BaseCSSResolver, _CommonExpansions):
     """Parses and resolves CSS to atomic CSS 2.2 properties
+
+    Parameters
+    ----------
+    initial : dict, optional
+        Atomic properties to use where a property is declared ``initial``,
+        or ``inherit`` without an inherited value.
+    cache_size : int, default 0
+        If positive, results of :meth:`resolve_string` are memoized for up to
+        this many distinct pairs of declarations and inherited context,
+        discarding the least recently used when full. See
+        :meth:`cache_info`.
+    cache_path : str, optional
+        If given, resolved results are also stored in an SQLite database at
+        this path, to be reused by resolvers with the same configuration in
+        other processes and later runs. Several processes may read and write
+        it concurrently. Entries are keyed by a stable hash of the resolver
+        class, ``initial``, ``color_format``, the conversion tables, the
+        version of cssdecl and the input. Entries from older versions are
+        deleted once a newer version uses the file. Values are stored as
+        JSON, so reading an untrusted file cannot run code. With
+        ``cache_size``, recently used entries are also held in memory.
+    color_format : {None, 'hex', 'rgba'}
+        By default colors are output as declared, but lowercased. Otherwise,
+        colors which are understood are output canonically, so that equal
+        colors have equal strings. 'hex' uses ``#rrggbb``, except for
+        translucent colors, which like all colors in 'rgba' format are
+        given as ``rgba(r, g, b, alpha)``.
+    profile : bool or callable, default False
+        If true, the time spent in each phase of resolution is accumulated in
+        :attr:`stats`. If callable, it is also called as
+        ``profile(phase, seconds)`` each time a phase completes. Profiling is
+        not retained when the resolver is pickled.
+    diagnostics : Diagnostics, optional
+        If given, problems with the CSS, such as unsupported sizes, are
+        counted in this collector instead of each being issued as a
+        :class:`CSSWarning`. Results taken from the cache are not counted
+        again. Diagnostics from worker processes are merged into this
+        collector, but a pickled resolver otherwise starts an empty one.
+
+    Notes
+    -----
+    A resolver may be shared between threads, including on free-threaded
+    builds of Python, provided its configuration is not changed, and no
+    expanders are registered, while it is in use. Its cache is split into
+    separately locked stripes, and the diagnostics collector and profiling
+    statistics are also locked. See ``backend='thread'`` in
+    :meth:`resolve_many`.
+
+    Examples
+    --------
+    >>> resolver = CSS22Resolver(color_format='hex')
+    >>> resolver.resolve_string('color: RED; background-color: rgb(0,0,255)')
+    {'color': '#ff0000', 'background-color': '#0000ff'}
     """
@@ -1,19 +1,54 @@
+import io
+import os
+import pickle
+import platform
+import subprocess
+import sys
+
 import pytest
+import tinycss2
 
-from cssdecl import CSS22Resolver, CSSWarning
+import cssdecl
+from cssdecl import CSS22Resolver, CSSWarning, ComputedStyle, Diagnostics
+from cssdecl import StyleRegistry
+from cssdecl import read_declarations, _scan_declarations
 
 
 # TODO: should add generic variants of tests, e.g. with hypothesis
 #       to test for comment intrusion, alternative whitespace, etc.
 
 
+def _describe_declarations(declarations):
+    out = []
+    for name, value in declarations:
+        tokens = [(tok.type, tok.source_line, tok.source_column,
+                   tok.serialize(),
+                   [getattr(tok, attr, None)
+                    for attr in ['value', 'int_value', 'representation',
+                                 'unit', 'is_identifier']])
+                  for tok in value if tok.type != 'whitespace']
+        out.append((name, tinycss2.serialize(value).strip(), tokens))
+    return out
+
+
+def assert_fast_parse_consistent(css):
+    """Where the fast scanner handles css, it must match tinycss2"""
+    fast = _scan_declarations(css)
+    if fast is not None:
+        slow = list(CSS22Resolver()._parse_tinycss2(css))
+        assert _describe_declarations(fast) == _describe_declarations(slow)
+
+
 def assert_resolves(css, props, inherited=None):
+    assert_fast_parse_consistent(css)
     resolver = CSS22Resolver()
     actual = resolver.resolve_string(css, inherited=inherited)
     assert props == actual
 
 
 def assert_same_resolution(css1, css2, inherited=None):
+    assert_fast_parse_consistent(css1)
+    assert_fast_parse_consistent(css2)
     resolver = CSS22Resolver()
     resolved1 = resolver.resolve_string(css1, inherited=inherited)
     resolved2 = resolver.resolve_string(css2, inherited=inherited)
@@ -148,7 +183,6 @@ def test_css_side_shorthands(shorthand, expansions, inherited):
                         {})
 
 
-@pytest.mark.xfail(reason='CSS font shorthand not yet handled')
 @pytest.mark.parametrize('css,props', [
     ('font: italic bold 12pt helvetica,sans-serif',
      {'font-family': 'helvetica,sans-serif',
@@ -160,16 +194,48 @@ def test_css_side_shorthands(shorthand, expansions, inherited):
       'font-style': 'italic',
       'font-weight': 'bold',
       'font-size': '12pt'}),
+    ('font: small-caps 600 2em/1.5 "Times New Roman", serif',
+     {'font-family': '"times new roman", serif',
+      'font-variant': 'small-caps',
+      'font-weight': '600',
+      'font-size': '24pt',
+      'line-height': '1.5'}),
+    ('font: normal normal 10pt/12pt bold',
+     {'font-family': 'bold',
+      'font-style': 'normal',
+      'font-variant': 'normal',
+      'font-size': '10pt',
+      'line-height': '12pt'}),
+    ('font: larger monospace; font: inherit', {}),
 ])
 def test_css_font_shorthand(css, props):
     assert_resolves(css, props)
 
 
-@pytest.mark.xfail(reason='CSS background shorthand not yet handled')
+@pytest.mark.parametrize('css', [
+    'font: bold serif',
+    'font: 12pt',
+    'font: 12pt / serif',
+    'font: 12pt/',
+    'font: 12px/1.5/2 serif',
+    'font: 450 12pt serif',
+    'font: italic italic 12pt serif',
+    'font: 12pt inherit',
+    'font: caption',
+    'border: 1px inherit',
+])
+def test_css_shorthand_invalid(css):
+    with pytest.warns(CSSWarning, match='Could not expand'):
+        assert_resolves(css, {})
+
+
 @pytest.mark.parametrize('css,props', [
     ('background: blue', {'background-color': 'blue'}),
     ('background: fixed blue',
      {'background-color': 'blue', 'background-attachment': 'fixed'}),
+    ('background: url(a.png) no-repeat 0 50% #FFF',
+     {'background-color': '#fff', 'background-image': 'url(a.png)',
+      'background-repeat': 'no-repeat', 'background-position': '0 50%'}),
 ])
 def test_css_background_shorthand(css, props):
     assert_resolves(css, props)
@@ -220,6 +286,8 @@ def test_css_border_shorthand(style, equiv, side, width, color, inherited):
      'margin: 1px; margin-top: 2px'),
 ])
 def test_css_precedence(style, inherited, equiv):
+    for css in [style, inherited, equiv]:
+        assert_fast_parse_consistent(css)
     resolver = CSS22Resolver()
     inherited_props = resolver.resolve_string(inherited)
     style_props = resolver.resolve_string(style, inherited=inherited_props)
@@ -296,3 +364,1028 @@ def test_css_relative_font_size(size, relative_to, resolved):
         inherited = {'font-size': relative_to}
     assert_resolves('font-size: %s' % size, {'font-size': resolved},
                     inherited=inherited)
+
+
+def test_cache():
+    resolver = CSS22Resolver(cache_size=2)
+    inherited = {'font-size': '16pt'}
+    expected = CSS22Resolver().resolve_string('font-size: 1em', inherited)
+
+    assert resolver.resolve_string('font-size: 1em', inherited) == expected
+    assert resolver.resolve_string('font-size: 1em',
+                                   dict(inherited)) == expected
+    assert resolver.cache_info() == (1, 1, 0, 2, 1)
+
+    # returned values are copies
+    resolver.resolve_string('font-size: 1em', inherited).clear()
+    assert resolver.resolve_string('font-size: 1em', inherited) == expected
+
+    # inherited context is part of the key
+    assert resolver.resolve_string('font-size: 1em') == {'font-size': '12pt'}
+    resolver.resolve_string('color: red')
+    assert resolver.cache_info() == (3, 3, 1, 2, 2)
+
+    # least recently used entry was evicted
+    resolver.resolve_string('color: red')
+    assert resolver.cache_info().hits == 4
+    resolver.resolve_string('font-size: 1em', inherited)
+    assert resolver.cache_info().misses == 4
+
+    resolver.cache_clear()
+    assert resolver.cache_info() == (0, 0, 0, 2, 0)
+    assert CSS22Resolver().cache_info() is None
+
+
+@pytest.mark.parametrize('cache_size', [0, 10])
+def test_resolve_many(cache_size):
+    resolver = CSS22Resolver(cache_size=cache_size)
+    inherited = {'font-size': '16pt', 'color': 'blue'}
+    items = ['font-size: 2em', ('font-size: 2em', None), 'color: inherit',
+             ('font-size: 2em', {'font-size': '10pt'}), '',
+             ('color: inherit', inherited), 'font-size: 2em']
+    out = resolver.resolve_many(items, inherited=inherited)
+
+    expected = []
+    for item in items:
+        if isinstance(item, str):
+            expected.append(resolver.resolve_string(item, inherited))
+        else:
+            expected.append(resolver.resolve_string(*item))
+    assert out == expected
+    assert out[0] is out[6]
+    assert out[2] is out[5]
+    assert out[0] is not out[1]
+    assert resolver.resolve_many([]) == []
+
+
+def test_expander_registry():
+    class MarginResolver(CSS22Resolver):
+        def expand_margin(self, prop, value):
+            yield 'margin-top', value
+
+    class TextResolver(MarginResolver):
+        pass
+
+    @TextResolver.register_expander('text-decoration')
+    def expand_text_decoration(resolver, prop, value):
+        assert isinstance(resolver, TextResolver)
+        for token in value:
+            if token.type == 'ident':
+                yield 'text-decoration-' + token.lower_value, [token]
+
+    css = 'margin: 1pt; text-decoration: underline overline'
+    assert CSS22Resolver().resolve_string(css) == {
+        'margin-top': '1pt', 'margin-right': '1pt', 'margin-bottom': '1pt',
+        'margin-left': '1pt', 'text-decoration': 'underline overline'}
+    assert MarginResolver().resolve_string(css) == {
+        'margin-top': '1pt', 'text-decoration': 'underline overline'}
+    assert TextResolver().resolve_string(css) == {
+        'margin-top': '1pt', 'text-decoration-underline': 'underline',
+        'text-decoration-overline': 'overline'}
+
+    # registries already built are updated
+    MarginResolver.register_expander('margin', lambda self, prop, value: [])
+    assert TextResolver().resolve_string(css) == {
+        'text-decoration-underline': 'underline',
+        'text-decoration-overline': 'overline'}
+    assert 'margin' in CSS22Resolver._get_expanders()
+
+
+def test_expander_string_values():
+    class SpacingResolver(CSS22Resolver):
+        def expand_padding(self, prop, value):
+            # generated values may be strings
+            yield 'padding-top', ' 2PT'
+
+        def expand_margin(self, prop, value):
+            # written when values were passed as strings
+            for side, val in zip(self.SIDES, value.split()):
+                yield 'margin-' + side, val
+
+    assert SpacingResolver().resolve_string('padding: 1pt') == {
+        'padding-top': '2pt'}
+    with pytest.raises(TypeError, match='expand_margin.*tinycss2'):
+        SpacingResolver().resolve_string('margin: 1pt')
+
+
+def test_size_conversion_tables():
+    class MyResolver(CSS22Resolver):
+        MARGIN_RATIOS = dict(CSS22Resolver.MARGIN_RATIOS,
+                             ft=('in', 12), yd=('ft', 3),
+                             foo=('bar', 1), bar=('foo', 1))
+
+    resolver = MyResolver()
+    for _ in range(2):
+        assert resolver.resolve_string('margin-top: .5yd') == {
+            'margin-top': '1296pt'}
+        assert resolver.resolve_string('margin-top: 2em; font-size: 5pt') == {
+            'margin-top': '10pt', 'font-size': '5pt'}
+        # unhandled sizes warn every time
+        with pytest.warns(CSSWarning):
+            assert resolver.resolve_string('margin-top: 1foo') == {
+                'margin-top': '0pt'}
+
+
+@pytest.mark.parametrize('inherited,typed_inherited', [
+    (None, None),
+    ({'font-size': '16pt', 'margin-top': '4pt', 'color': 'red'},
+     {'font-size': 16., 'margin-top': 4., 'color': (1., 0., 0., 1.)}),
+])
+def test_resolve_typed(inherited, typed_inherited):
+    css = ('font-size: 1.5em; border: thin solid rgb(0, 0, 255); '
+           'padding: 1em 2pt; background-color: CurrentColor; '
+           'font-family: serif')
+    resolver = CSS22Resolver()
+    as_str = resolver.resolve_string(css, inherited)
+    for context in [inherited, typed_inherited]:
+        typed = resolver.resolve_typed(css, context)
+        assert sorted(typed) == sorted(as_str)
+        for prop, val in typed.items():
+            if prop.endswith('-color') and prop != 'background-color':
+                assert val == (0, 0, 1, 1)
+            elif prop == 'color':
+                assert val == (1, 0, 0, 1)
+            elif isinstance(val, float):
+                assert '%fpt' % val == '%fpt' % float(as_str[prop][:-2])
+            else:
+                assert val == as_str[prop]
+        assert typed['background-color'] == 'currentcolor'
+
+    typed = resolver.resolve_typed('color: inherit; margin-top: 1em',
+                                   typed_inherited)
+    if typed_inherited is None:
+        assert typed == {'margin-top': 12.}
+    else:
+        assert typed == {'font-size': 16., 'margin-top': 16.,
+                         'color': (1, 0, 0, 1)}
+    assert resolver.resolve_many(['font-size: 1em'], typed=True) == [
+        {'font-size': 12.}]
+
+
+@pytest.mark.parametrize('css,dependent', [
+    ('color: red; margin: 1pt 2em', ['margin-left', 'margin-right']),
+    ('font-size: 8pt; margin: 1pt 2em', []),
+    ('font-size: larger; margin-top: 2em; padding-top: 1ex; '
+     'border-top-width: 2pt',
+     ['font-size', 'margin-top', 'padding-top']),
+    ('font-size: inherit; margin-top: 2em; color: inherit',
+     ['font-size', 'margin-top', 'color']),
+    ('font-size: initial; margin-top: 2em; color: initial', []),
+    ('font-size: 10px; font-size: 1em; border-top: thick solid',
+     ['font-size']),
+])
+def test_compile(css, dependent):
+    resolver = CSS22Resolver(initial={'color': 'black', 'font-size': 'small',
+                                      'margin-top': '1em'})
+    compiled = resolver.compile(css)
+    assert compiled.declarations_str == css
+    assert compiled.context_dependent == frozenset(dependent)
+    with pytest.raises(AttributeError):
+        compiled.declarations_str = 'color: blue'
+
+    for inherited in [None,
+                      {'font-size': '10pt'},
+                      {'font-size': '10pt', 'color': 'green',
+                       'border-top-width': '3pt', 'margin-top': '4pt'},
+                      {'color': 'green', 'margin-left': '5pt'}]:
+        for typed in [False, True]:
+            expected = resolver._resolve_cached(css, inherited, typed)
+            assert compiled.resolve(inherited, typed=typed) == expected
+
+
+@pytest.mark.parametrize('typed', [False, True])
+def test_resolve_tree(typed):
+    resolver = CSS22Resolver(initial={'color': 'black'})
+    cell_css = ['font-size: 2em; margin: 1em', '', 'font-weight: initial',
+                'color: inherit; font-weight: normal', 'font-size: 2em',
+                'font-size: 2em']
+    tree = ('font-size: 10pt; color: red; font-weight: bold', [
+        ('background-color: blue; margin-top: 1em',
+         [(css, []) for css in cell_css]),
+        ('', [('font-size: 50%; margin-left: 1pt', [])]),
+    ])
+    inherited = {'font-family': 'serif'}
+    resolve = resolver.resolve_typed if typed else resolver.resolve_string
+
+    sheet_style, rows = resolver.resolve_tree(tree, inherited, typed=typed)
+    sheet_expected = resolve(tree[0], inherited)
+    assert sheet_style == sheet_expected
+    assert len(rows) == 2
+    for (row_style, cells), (row_css, cell_trees) in zip(rows, tree[1]):
+        row_expected = resolve(row_css, sheet_expected)
+        assert dict(row_style) == row_expected
+        assert len(cells) == len(cell_trees)
+        for (cell_style, children), (css, _) in zip(cells, cell_trees):
+            assert children == []
+            assert dict(cell_style) == resolve(css, row_expected)
+            assert len(cell_style) == len(resolve(css, row_expected))
+            assert dict(resolver.resolve_tree((css, []), row_style,
+                                              typed=typed)[0]) == \
+                dict(cell_style)
+    assert rows[1][0] is sheet_style
+    assert rows[0][1][1][0] is rows[0][0]
+    assert rows[0][1][4][0] is rows[0][1][5][0]
+    assert 'font-weight' not in rows[0][1][2][0]
+
+    # initial values where the parent lacks the property
+    tree = ('font-size: 10pt', [('color: inherit; margin-top: inherit', [])])
+    sheet_style, [(cell_style, _)] = resolver.resolve_tree(tree, typed=typed)
+    assert dict(cell_style) == resolve(tree[1][0][0], resolve(tree[0]))
+    if typed:
+        assert cell_style['color'] == (0, 0, 0, 1)
+
+    # removed properties stay removed in copies, e.g. sent to workers
+    import copy
+    tree = ('font-weight: bold', [('font-weight: initial; color: red', [])])
+    _, [(row_style, _)] = resolver.resolve_tree(tree, typed=typed)
+    assert 'font-weight' not in row_style
+    for copied in [pickle.loads(pickle.dumps(row_style)),
+                   copy.deepcopy(row_style)]:
+        assert dict(copied) == dict(row_style)
+    items = [('margin-top: 1pt', row_style), ('margin-top: 2pt', row_style)]
+    assert resolver.resolve_many(items, typed=typed, n_jobs=2) == [
+        resolve(css, dict(row_style)) for css, _ in items]
+
+
+def test_resolve_tree_deep():
+    resolver = CSS22Resolver()
+    depth = 30
+    tree = ('font-size: 10pt', [])
+    node = tree
+    for i in range(depth):
+        child = ('font-size: 1.1em; margin-%d: %dpt' % (i, i), [])
+        node[1].append(child)
+        node = child
+    style, children = resolver.resolve_tree(tree)
+    expected = resolver.resolve_string(tree[0])
+    for i in range(depth):
+        (style, children), = children
+        expected = resolver.resolve_string('font-size: 1.1em; margin-%d: %dpt'
+                                           % (i, i), expected)
+        assert style == expected
+        assert style._depth() <= style.MAX_DEPTH
+
+
+def test_computed_style():
+    props = {'font-size': '12pt', 'color': 'red', 'margin-top': 1.5}
+    style = ComputedStyle(props)
+    assert style == props
+    assert props == dict(style)
+    assert style != {'font-size': '12pt'}
+    assert len(style) == 3
+    assert list(style) == sorted(props)
+    assert style['margin-top'] == 1.5
+    assert style.get('margin-left') is None
+    assert 'color' in style and 'margin-left' not in style
+    with pytest.raises(KeyError):
+        style['margin-left']
+
+    other = ComputedStyle(dict(props))
+    assert other == style
+    assert hash(other) == hash(style)
+    assert other._layout is style._layout
+    assert other['color'] is style['color']
+    assert ComputedStyle(style) == style
+    assert len({style, other, ComputedStyle({'color': 'red'})}) == 2
+    assert ComputedStyle() == {}
+    assert pickle.loads(pickle.dumps(style)) == style
+
+
+@pytest.mark.parametrize('cache_size', [0, 10])
+def test_resolve_style(cache_size):
+    resolver = CSS22Resolver(cache_size=cache_size)
+    row = resolver.resolve_style('font-size: 10pt; color: red')
+    assert isinstance(row, ComputedStyle)
+    cell = resolver.resolve_style('font-size: 2em; margin-top: 1em', row)
+    assert cell == resolver.resolve_string(
+        'font-size: 2em; margin-top: 1em',
+        resolver.resolve_string('font-size: 10pt; color: red'))
+    assert resolver.resolve_style('font-size: 2em; margin-top: 1em',
+                                  dict(row)) == cell
+    typed = resolver.resolve_style('font-size: 2em', row, typed=True)
+    assert typed == {'font-size': 20., 'color': (1, 0, 0, 1)}
+    hash(typed)
+
+
+@pytest.mark.parametrize('css,simple', [
+    ('', True),
+    (';;', True),
+    ('color: red', True),
+    (' \t Color \t :\n  RED \n  ;  \n margin: \t1px 2.5EM -3pt +.5%\n',
+     True),
+    ('border: thin solid #F00; color: #123abc; x: #-a #-1 #1a #_b', True),
+    ('font-family: Times New Roman, serif; font-size: 10', True),
+    ('-webkit-hello: world; font-size:', True),
+    ('a: b: c', False),
+    ('hello-world', False),
+    ('hello world: foo', False),
+    ('color: red;; hello-world', False),
+    ('font-weight: bold !important', False),
+    ('hello/* foo */: world', False),
+    ('color: rgb(5, 10, 20)', False),
+    ('font-family: "abc"', False),
+    ('font-size: 1e5pt', False),
+    ('font-size: 1E-5pt', False),
+    ('font-size: 1ex', True),
+    ('font-size: 1+6pt', False),
+    ('font-size: 1.', False),
+    ('font-size: 1.5.5pt', False),
+    ('font-size: 1-px', False),
+    ('unicode-range: u+1f', False),
+    ('content: \\61', False),
+    ('color: r\xe9d', False),
+    ('color: red\r\n', False),
+])
+def test_scan_declarations(css, simple):
+    assert (_scan_declarations(css) is not None) == simple
+    assert_fast_parse_consistent(css)
+
+
+# Budget, in microseconds, for importing cssdecl excluding the modules it
+# imports, as reported by ``python -X importtime``
+IMPORT_SELF_TIME_BUDGET = 10000
+# Budget including the modules it imports
+IMPORT_CUMULATIVE_TIME_BUDGET = 50000
+
+
+@pytest.mark.skipif(platform.python_implementation() != 'CPython'
+                    or sys.version_info < (3, 8),
+                    reason='requires -X importtime and PYTHONPYCACHEPREFIX')
+def test_import_time(tmpdir):
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=str(tmpdir))
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    cssdecl_dir = os.path.dirname(os.path.abspath(cssdecl.__file__))
+    timings = []
+    for i in range(4):
+        # the first run compiles bytecode
+        stderr = subprocess.check_output(
+            [sys.executable, '-X', 'importtime', '-c', 'import cssdecl'],
+            stderr=subprocess.STDOUT, env=env, cwd=cssdecl_dir,
+            universal_newlines=True)
+        imported = {}
+        for line in stderr.splitlines():
+            if line.startswith('import time:') and '|' in line:
+                self_us, cumulative_us, name = line[12:].split('|')
+                if self_us.strip().isdigit():
+                    imported[name.strip()] = (int(self_us),
+                                              int(cumulative_us))
+        assert 'cssdecl' in imported
+        assert not any(name.startswith('tinycss2') for name in imported)
+        timings.append(imported['cssdecl'])
+
+    assert min(self_us for self_us, _ in timings[1:]) < \
+        IMPORT_SELF_TIME_BUDGET
+    assert min(cumulative_us for _, cumulative_us in timings[1:]) < \
+        IMPORT_CUMULATIVE_TIME_BUDGET
+
+
+@pytest.mark.parametrize('color_format,opaque,translucent', [
+    (None, None, None),
+    ('hex', '#ff0000', 'rgba(255, 0, 0, 0.5)'),
+    ('rgba', 'rgba(255, 0, 0, 1)', 'rgba(255, 0, 0, 0.5)'),
+])
+def test_color_format(color_format, opaque, translucent):
+    resolver = CSS22Resolver(color_format=color_format,
+                             initial={'color': 'Red'})
+    values = set()
+    for css in ['color: red', 'color: RED', 'color: #f00', 'color: #FF0000',
+                'color: rgb(255,0,0)', 'color: rgb(100%, 0%, 0%)',
+                'color: hsl(0, 100%, 50%)', 'color: initial',
+                'color: inherit', 'border-color: red']:
+        values.update(resolver.resolve_string(css).values())
+    if color_format is None:
+        assert len(values) > 1
+    else:
+        assert values == {opaque}
+    out = resolver.resolve_string('color: rgba(255, 0, 0, .5); '
+                                  'border-top: currentColor solid')
+    assert out['border-top-color'] == 'currentcolor'
+    if translucent is not None:
+        assert out['color'] == translucent
+    typed = resolver.resolve_typed('color: #f00; border-top-color: '
+                                   'rgba(255, 0, 0, .5)')
+    assert typed == {'color': (1, 0, 0, 1),
+                     'border-top-color': (1, 0, 0, .5)}
+
+    with pytest.raises(ValueError):
+        CSS22Resolver(color_format='rgb')
+
+
+@pytest.mark.parametrize('typed', [False, True])
+def test_resolve_many_parallel(typed):
+    resolver = CSS22Resolver(initial={'color': 'black'}, color_format='hex',
+                             cache_size=10)
+    items = ['font-size: %dpt; margin: 1em; color: inherit' % (i % 7)
+             for i in range(50)]
+    items.append(('color: inherit', {'color': 'blue'}))
+    expected = resolver.resolve_many(items, typed=typed)
+    assert resolver.resolve_many(items, typed=typed, n_jobs=2,
+                                 chunksize=3) == expected
+    assert resolver.resolve_many(items, typed=typed, n_jobs=-1) == expected
+
+
+def test_pickle_resolver():
+    resolver = CSS22Resolver(initial={'color': 'black'}, cache_size=10)
+    resolver.resolve_string('color: red')
+    unpickled = pickle.loads(pickle.dumps(resolver))
+    assert unpickled.initial == resolver.initial
+    assert unpickled.cache_info() == (0, 0, 0, 10, 0)
+    assert resolver.cache_info().currsize == 1
+
+
+def test_profile():
+    assert CSS22Resolver().stats is None
+
+    calls = []
+
+    def callback(phase, seconds):
+        calls.append(phase)
+
+    resolver = CSS22Resolver(initial={'color': 'black'}, profile=callback)
+    decl = ('border-top: 1px solid red; margin: 1em 2em; color: inherit; '
+            'font-size: 2em; padding: 1pt 2pt 3pt 4pt 5pt')
+    with pytest.warns(CSSWarning):
+        out = resolver.resolve_string(decl)
+    assert out == CSS22Resolver(initial={'color': 'black'}).resolve_string(
+        decl)
+    stats = resolver.stats
+    assert sorted(stats) == ['expand:border-top', 'expand:margin',
+                             'expand:padding', 'font-size', 'inherit',
+                             'parse', 'size', 'warn']
+    assert stats['parse'].calls == 1
+    assert stats['warn'].calls == 1
+    # border-top-width, font-size and four margins
+    assert stats['size'].calls == 6
+    assert all(seconds >= 0 for _, seconds in stats.values())
+    assert sorted(calls) == sorted(phase for phase, (n, _) in stats.items()
+                                   for _ in range(n))
+
+    # the callback is invoked per call, whereas stats accumulate
+    resolver.resolve_string('margin: 1pt')
+    assert resolver.stats['expand:margin'].calls == 2
+    resolver.stats_clear()
+    assert resolver.stats == {}
+
+    # profiling is not pickled, e.g. for worker processes
+    unpickled = pickle.loads(pickle.dumps(resolver))
+    assert unpickled.stats is None
+    assert '_parse' not in vars(unpickled)
+    assert unpickled.resolve_string('padding: 1pt') == {
+        'padding-top': '1pt', 'padding-right': '1pt',
+        'padding-bottom': '1pt', 'padding-left': '1pt'}
+
+
+def test_diagnostics(recwarn):
+    diagnostics = Diagnostics()
+    resolver = CSS22Resolver(diagnostics=diagnostics)
+    for _ in range(3):
+        assert resolver.resolve_string('margin: 1 2 3 4 5') == {}
+        assert resolver.resolve_string('margin-top: 2qq; font-size: 1em') \
+            == {'margin-top': '0pt', 'font-size': '12pt'}
+        assert resolver.resolve_string('border: 1pt solid red }')[
+            'border-top-style'] == 'solid'
+        resolver.resolve_typed('border-top-width: 2qq')
+    assert not recwarn
+    assert [tuple(diagnostic) + (count,)
+            for diagnostic, count in diagnostics.items()] == [
+        ('unexpandable', 'margin', '1 2 3 4 5',
+         'Could not expand "margin: 1 2 3 4 5"', 3),
+        ('unhandled-size', 'margin-top', '2qq', "Unhandled size: '2qq'", 3),
+        ('parse-error', 'border', '1pt solid red }',
+         "Error parsing CSS: 'Unmatched }'", 3),
+        ('unhandled-size', 'border-top-width', '2qq',
+         "Unhandled size: '2qq'", 3),
+    ]
+
+    # diagnostics from worker processes are merged
+    diagnostics.clear()
+    assert not diagnostics
+    resolver.resolve_many(['margin: %dpt 1foo' % i for i in range(10)],
+                          n_jobs=2, chunksize=2)
+    # for margin-right and margin-left
+    assert list(diagnostics.values()) == [10, 10]
+    assert pickle.loads(pickle.dumps(resolver)).diagnostics == {}
+
+    # emit warns only once per distinct diagnostic
+    resolver = CSS22Resolver(diagnostics=Diagnostics(emit=True))
+    with pytest.warns(CSSWarning) as record:
+        for _ in range(3):
+            resolver.resolve_string('margin-top: 2qq; margin-left: 3qq')
+    assert len(record) == 2
+    assert sorted(resolver.diagnostics.values()) == [3, 3]
+
+
+@pytest.mark.parametrize('format,text', [
+    ('lines', 'color: red\nfont-size: 2em\r\n\ncolor: red'),
+    ('jsonl', '"color: red"\n{"declarations": "font-size: 2em"}\n\n'
+              '{"declarations": "", "inherited": null}\n"color: red"\n'),
+    ('nul', 'color: red\0font-size: 2em\0\0color: red'),
+])
+def test_read_declarations(format, text):
+    expected = ['color: red', 'font-size: 2em', '', 'color: red']
+    assert list(read_declarations(io.StringIO(text), format)) == expected
+    assert list(read_declarations(text.splitlines(True), format)) == expected
+
+
+def test_read_declarations_nul_chunks():
+    chunks = ['color: r', 'ed\0font-', 'size: 2em; ', 'margin: 0\0\0', 'a']
+    assert list(read_declarations(chunks, 'nul')) == [
+        'color: red', 'font-size: 2em; margin: 0', '', 'a']
+
+    with pytest.raises(ValueError):
+        list(read_declarations(chunks, 'csv'))
+
+
+def test_resolve_iter():
+    lines = ['{"declarations": "font-size: 2em", '
+             '"inherited": {"font-size": "10pt"}}\n',
+             '"font-size: 2em"\n'] * 3
+
+    def source():
+        for i, line in enumerate(lines):
+            yield line
+            # results are yielded lazily, as lines are read
+            assert len(out) == i + 1
+
+    out = []
+    resolver = CSS22Resolver()
+    for props in resolver.resolve_iter(read_declarations(source(), 'jsonl'),
+                                       typed=True):
+        out.append(props)
+    assert out == [{'font-size': 20.}, {'font-size': 24.}] * 3
+    assert out[0] is not out[2]
+
+    resolver = CSS22Resolver(cache_size=10)
+    out = list(resolver.resolve_iter(['font-size: 2em', 'color: red'] * 3,
+                                     inherited={'font-size': '10pt'}))
+    assert out == [{'font-size': '20pt'},
+                   {'font-size': '10pt', 'color': 'red'}] * 3
+    assert resolver.cache_info()[:2] == (4, 2)
+
+
+@pytest.mark.parametrize('typed', [False, True])
+@pytest.mark.parametrize('with_pandas', [False, True])
+def test_resolve_columns_numpy(typed, with_pandas, monkeypatch):
+    np = pytest.importorskip('numpy')
+    if with_pandas:
+        pytest.importorskip('pandas')
+    else:
+        monkeypatch.setitem(sys.modules, 'pandas', None)
+    resolver = CSS22Resolver()
+    resolve = resolver.resolve_typed if typed else resolver.resolve_string
+    cells = np.array([['font-size: 2em; color: red', 'margin: 1em 2pt'],
+                      ['', 'font-size: 2em; color: red'],
+                      ['border-top: 1px solid red', 'margin: 1em 2pt']],
+                     dtype=object)
+    inherited = np.array([[None, {'font-size': '10pt'}],
+                          [{'color': 'blue'}, None],
+                          [None, {'font-size': '10pt'}]], dtype=object)
+    for context in [None, {'font-size': '10pt'}, inherited]:
+        out = resolver.resolve_columns(cells, context, typed=typed)
+        assert out.shape == cells.shape
+        for idx in np.ndindex(*cells.shape):
+            cell_context = context
+            if context is inherited:
+                cell_context = inherited[idx]
+            expected = resolve(cells[idx], cell_context)
+            for prop in out.dtype.names:
+                val = out[idx][prop]
+                if prop not in expected:
+                    assert val is None or np.isnan(val)
+                else:
+                    assert val == expected[prop]
+                    if isinstance(val, float):
+                        assert out.dtype[prop] == float
+            assert set(expected) <= set(out.dtype.names)
+
+    with pytest.raises(ValueError, match='shape'):
+        resolver.resolve_columns(cells, inherited[:2])
+
+
+def test_resolve_columns_pandas():
+    pd = pytest.importorskip('pandas')
+    resolver = CSS22Resolver()
+    series = pd.Series(['font-size: 2em', None, 'margin-left: 1em',
+                        'font-size: 2em'], index=list('abcd'))
+    out = resolver.resolve_columns(series, typed=True)
+    assert list(out.index) == list('abcd')
+    assert list(out.columns) == ['font-size', 'margin-left']
+    assert out['font-size'].tolist()[::3] == [24., 24.]
+    assert out['margin-left']['c'] == 12.
+    assert out.iloc[1].isnull().all()
+
+    frame = pd.DataFrame({'x': ['color: red', 'font-size: 2em'],
+                          'y': ['font-size: 1pt', 'color: red']})
+    out = resolver.resolve_columns(
+        frame, inherited=pd.DataFrame({'x': [None, {'font-size': '10pt'}],
+                                       'y': [None, None]}))
+    assert list(out.index) == [(0, 'x'), (0, 'y'), (1, 'x'), (1, 'y')]
+    assert out.loc[(1, 'x'), 'font-size'] == '20pt'
+    assert out.loc[(0, 'x'), 'color'] == 'red'
+
+
+def test_cache_path(tmpdir, monkeypatch):
+    path = str(tmpdir.join('cache.sqlite'))
+    inherited = {'font-size': '10pt', 'color': 'red'}
+    resolver = CSS22Resolver(cache_path=path)
+    expected = resolver.resolve_string('font-size: 2em', inherited)
+    assert resolver.cache_info() == (0, 1, 0, None, 1)
+
+    # shared between resolvers, e.g. in a later run
+    resolver = CSS22Resolver(cache_path=path, cache_size=2)
+    assert resolver.resolve_string('font-size: 2em',
+                                   dict(inherited)) == expected
+    assert resolver.resolve_string('font-size: 2em', inherited) == expected
+    assert resolver.cache_info() == (2, 0, 0, 2, 1)
+    assert resolver.resolve_typed('color: red') == {
+        'color': CSS22Resolver().resolve_typed('color: red')['color']}
+    style = resolver.resolve_style('font-size: 2em',
+                                   resolver.resolve_style('font-size: 10pt'))
+    assert style == {'font-size': '20pt'}
+    assert isinstance(
+        CSS22Resolver(cache_path=path).resolve_style(
+            'font-size: 2em', ComputedStyle({'font-size': '10pt'})),
+        ComputedStyle)
+
+    # separate entries for resolvers configured differently
+    class MyResolver(CSS22Resolver):
+        FONT_SIZE_RATIOS = dict(CSS22Resolver.FONT_SIZE_RATIOS,
+                                px=('pt', 1))
+
+    for other in [CSS22Resolver(cache_path=path, initial={'color': 'blue'}),
+                  CSS22Resolver(cache_path=path, color_format='hex'),
+                  MyResolver(cache_path=path)]:
+        other.resolve_string('font-size: 2em', inherited)
+        assert other.cache_info()[:2] == (0, 1)
+    assert CSS22Resolver(cache_path=path).resolve_string(
+        'font-size: 4px') == {'font-size': '3pt'}
+    assert MyResolver(cache_path=path).resolve_string('font-size: 4px') == {
+        'font-size': '4pt'}
+
+    # concurrent writers
+    resolver = CSS22Resolver(cache_path=path)
+    items = ['margin: %dpt' % i for i in range(50)]
+    expected = CSS22Resolver().resolve_many(items)
+    assert resolver.resolve_many(items, n_jobs=2, chunksize=5) == expected
+    assert resolver.resolve_many(items) == expected
+    assert resolver.cache_info().hits == 50
+    assert pickle.loads(pickle.dumps(resolver)).cache_info().currsize > 50
+
+    resolver.cache_clear()
+    assert resolver.cache_info() == (0, 0, 0, None, 0)
+    assert MyResolver(cache_path=path).cache_info().currsize == 2
+
+    # values are read as JSON, never unpickled
+    import sqlite3
+    conn = sqlite3.connect(path)
+    conn.execute('UPDATE resolved SET value = ?',
+                 (pickle.dumps({'font-size': '1pt'}),))
+    conn.commit()
+    resolver = MyResolver(cache_path=path)
+    assert resolver.resolve_string('font-size: 4px') == {'font-size': '4pt'}
+    assert resolver.cache_info()[:2] == (0, 1)
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master "
+                        "WHERE name = 'resolved_namespace'").fetchone() == (1,)
+
+    # entries from other versions are not visible, and older versions do not
+    # delete those of newer versions
+    version = cssdecl.__version__
+    monkeypatch.setattr(cssdecl, '__version__', '0.0.0')
+    assert MyResolver(cache_path=path).cache_info().currsize == 0
+    MyResolver(cache_path=path).resolve_string('font-size: 1px')
+    monkeypatch.setattr(cssdecl, '__version__', version)
+    assert MyResolver(cache_path=path).cache_info().currsize == 2
+    # but newer versions delete those of older versions
+    monkeypatch.setattr(cssdecl, '__version__', '99.0')
+    assert MyResolver(cache_path=path).cache_info().currsize == 0
+    monkeypatch.setattr(cssdecl, '__version__', version)
+    assert MyResolver(cache_path=path).cache_info().currsize == 0
+    conn.close()
+
+
+@pytest.mark.parametrize('typed', [False, True])
+@pytest.mark.parametrize('inherited', [
+    None,
+    {'font-size': '10pt', 'color': 'blue', 'margin-top': '3pt'},
+])
+@pytest.mark.parametrize('base', [
+    '',
+    'font-size: 15pt; color: red; border-top: 1pt solid',
+    'font-size: larger; margin: 2pt; color: inherit',
+    'color: initial; margin-top: 4pt',
+    'font-size: 15pt; margin: 1em 2em; border-top: .5em solid',
+    'margin-left: 2em; padding-top: inherit; border-left-width: 1ex',
+])
+@pytest.mark.parametrize('extra', [
+    '',
+    'color: green',
+    'margin-left: 2em; border-top-width: .5em',
+    'font-size: 2em; margin-left: 2em',
+    'font-size: 1pt; color: inherit',
+    'font-size: inherit; margin: 1em',
+    'font-size: initial; margin-top: 1em; color: initial',
+    'margin-top: inherit; border-top-color: initial',
+])
+def test_update(base, extra, inherited, typed):
+    resolver = CSS22Resolver(initial={'font-size': '11pt',
+                                      'padding-top': '1em'})
+    resolve = resolver.resolve_typed if typed else resolver.resolve_string
+    if typed and inherited is not None:
+        inherited = resolver.resolve_typed('', inherited)
+    resolved = resolve(base, inherited)
+    expected = resolve(base + '; ' + extra, inherited)
+    for base_arg in [base, resolver.compile(base)]:
+        assert resolver.update(resolved, extra, inherited, typed=typed,
+                               base=base_arg) == expected
+    assert resolved == resolve(base, inherited)
+
+
+def test_update_computed():
+    resolver = CSS22Resolver()
+    base = 'font-size: 10pt; margin-top: 2em; margin-left: 1em'
+    resolved = resolver.resolve_string(base)
+    # without base, sizes already resolved are not rescaled
+    assert resolver.update(resolved, 'font-size: 20pt') == {
+        'font-size': '20pt', 'margin-top': '20pt', 'margin-left': '10pt'}
+    assert resolver.update(resolved, 'font-size: 20pt; margin-left: 1pt',
+                           base=base) == {
+        'font-size': '20pt', 'margin-top': '40pt', 'margin-left': '1pt'}
+
+
+def test_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    items = ['font-size: %dpt; margin: 1em 2em; color: #%03x; '
+             'border-top: %dpx solid; padding: 1foo'
+             % (i % 17, i % 101, i % 5) for i in range(1000)]
+    expected = [CSS22Resolver(diagnostics=Diagnostics()).resolve_string(item)
+                for item in items]
+    diagnostics = Diagnostics()
+    resolver = CSS22Resolver(cache_size=600, diagnostics=diagnostics,
+                             profile=True)
+    assert len(resolver._cache._stripes) > 1
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            out = list(executor.map(resolver.resolve_string, items))
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert out == expected
+    info = resolver.cache_info()
+    assert info.hits + info.misses == len(items)
+    assert info.currsize <= 600
+    assert sum(diagnostics.values()) == resolver.stats['warn'].calls
+    assert resolver.stats['parse'].calls == info.misses
+
+    for n_jobs in [1, 3]:
+        assert resolver.resolve_many(items, n_jobs=n_jobs, chunksize=50,
+                                     backend='thread') == expected
+    with pytest.raises(ValueError, match='backend'):
+        resolver.resolve_many(items, backend='threads')
+
+
+def _run_async(func, *args):
+    """Run func in a new event loop, returning the result of its future"""
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    ticks = []
+
+    def tick():
+        ticks.append(None)
+        if not result.done():
+            loop.call_soon(tick)
+
+    def start():
+        future = func(*args)
+        future.add_done_callback(
+            lambda future: result.set_exception(future.exception())
+            if future.exception() is not None
+            else result.set_result(future.result()))
+        tick()
+
+    try:
+        result = loop.create_future()
+        loop.call_soon(start)
+        return loop.run_until_complete(result), len(ticks)
+    finally:
+        loop.close()
+
+
+def _collect_async(iterator):
+    """Drain an async iterator into a list, without async syntax"""
+    import asyncio
+
+    out = []
+    result = asyncio.get_running_loop().create_future()
+
+    def next_item(future=None):
+        if future is not None:
+            if isinstance(future.exception(), StopAsyncIteration):
+                result.set_result(out)
+                return
+            out.append(future.result())
+        iterator.__anext__().add_done_callback(next_item)
+
+    next_item()
+    return result
+
+
+def test_aresolve():
+    from concurrent.futures import ThreadPoolExecutor
+
+    items = ['font-size: %dpt; padding: 1foo' % (i % 40) for i in range(100)]
+    items.append(('font-size: 2em', {'font-size': '10pt'}))
+    expected = CSS22Resolver(diagnostics=Diagnostics()).resolve_many(items)
+
+    diagnostics = Diagnostics()
+    resolver = CSS22Resolver(diagnostics=diagnostics, profile=True)
+    out, ticks = _run_async(resolver.aresolve_many, items, None, False, 10)
+    assert out == expected
+    assert out[0] is out[40]
+    # each distinct item resolved once, yielding to the loop between chunks
+    assert resolver.stats['parse'].calls == 41
+    assert ticks > 5
+    assert sum(diagnostics.values()) == 4 * 40
+
+    out, ticks = _run_async(lambda: _collect_async(
+        resolver.aresolve_iter(iter(items), chunksize=7)))
+    assert out == expected
+    assert out[0] is out[40]
+    assert resolver.stats['parse'].calls == 82
+    assert ticks > 15
+
+    for executor in [ThreadPoolExecutor(2), None]:
+        diagnostics.clear()
+        out, _ = _run_async(resolver.aresolve_many, items, None, True, 16,
+                            executor)
+        assert out == CSS22Resolver(diagnostics=Diagnostics()).resolve_many(
+            items, typed=True)
+        assert sum(diagnostics.values()) == 4 * 40
+        executor and executor.shutdown()
+
+    out, _ = _run_async(resolver.aresolve_many, [])
+    assert out == []
+    out, _ = _run_async(lambda: _collect_async(resolver.aresolve_iter([])))
+    assert out == []
+    with pytest.raises(ValueError, match='chunksize'):
+        resolver.aresolve_iter(items, chunksize=0)
+
+
+def test_aresolve_process_executor():
+    from concurrent.futures import ProcessPoolExecutor
+
+    items = ['font-size: %dpt; padding: 1foo' % (i % 10) for i in range(30)]
+    diagnostics = Diagnostics()
+    resolver = CSS22Resolver(diagnostics=diagnostics)
+    with ProcessPoolExecutor(2) as executor:
+        out, _ = _run_async(resolver.aresolve_many, items, None, False, 3,
+                            executor)
+    assert out == CSS22Resolver(diagnostics=Diagnostics()).resolve_many(items)
+    assert sum(diagnostics.values()) == 4 * 10
+
+
+def test_style_registry():
+    registry = StyleRegistry([{'color': 'red'}])
+    assert registry.intern(ComputedStyle({'color': 'red'})) == 0
+    assert registry.intern({'color': 'red', 'font-size': '2pt'}) == 1
+    assert registry.intern({}) == 2
+    assert len(registry) == 3
+    assert list(registry) == [{'color': 'red'},
+                              {'font-size': '2pt', 'color': 'red'}, {}]
+    assert registry.index({'font-size': '2pt', 'color': 'red'}) == 1
+    assert {'color': 'blue'} not in registry
+    with pytest.raises(ValueError):
+        registry.index({'color': 'blue'})
+    assert len(registry) == 3
+
+    copy = pickle.loads(pickle.dumps(registry))
+    assert list(copy) == list(registry)
+    assert copy.intern({'color': 'blue'}) == 3
+
+
+def test_resolve_ids():
+    resolver = CSS22Resolver()
+    items = ['font-size: %dpt; color: red' % (i % 7) for i in range(50)]
+    items.append(('font-size: 2em', {'font-size': '1pt'}))
+    expected = resolver.resolve_many(items)
+    ids, registry = resolver.resolve_ids(items)
+    assert len(ids) == len(items)
+    assert len(registry) == 8
+    assert [registry[style_id] for style_id in ids] == expected
+
+    more_ids, same = resolver.resolve_ids(['font-size: 1pt; color: red',
+                                           'color: blue'], registry=registry)
+    assert same is registry
+    assert list(more_ids) == [ids[1], 8]
+
+    for n_jobs, backend in [(2, 'thread'), (2, 'process')]:
+        out, registry = resolver.resolve_ids(items, typed=True, n_jobs=n_jobs,
+                                             backend=backend)
+        assert list(out) == list(ids)
+        assert registry[out[0]] == resolver.resolve_typed(items[0])
+
+
+@pytest.mark.parametrize('css', [
+    'font: bold 10pt serif; margin: 1em 2em; border-top: thin solid red; '
+    'color: #f00; padding-left: .5em',
+    'font-size: 2em;\n  margin: 1 2 3 4 5;\n  border: 2px dotted;\n'
+    '  background: url(x.png) red; text-align: right',
+    'font-weight: inherit; margin-top: inherit; font-size: inherit; '
+    'border-left-color: initial; color: "blue" !important',
+    'margin: 1px /* ; */ 2px; padding: 3em; color: red',
+    'border-width: thick 3pt; border-style: none; color: rgb(0, 0, 1)',
+])
+@pytest.mark.parametrize('properties', [
+    set(), {'color'}, {'margin-top', 'color'}, {'font-size'},
+    {'border-top-width', 'padding-left', 'text-align', 'font-weight'},
+    {'background-color', 'border-left-color', 'no-such-property'},
+])
+@pytest.mark.parametrize('inherited', [
+    None, {'font-size': '8pt', 'font-weight': 'bold', 'margin-top': '1pt'}])
+def test_resolve_properties(css, properties, inherited):
+    diagnostics = Diagnostics()
+    resolver = CSS22Resolver(diagnostics=diagnostics)
+    for resolve in [resolver.resolve_string, resolver.resolve_typed]:
+        full = resolve(css, inherited)
+        expected = dict((prop, val) for prop, val in full.items()
+                        if prop in properties)
+        assert resolve(css, inherited, properties=properties) == expected
+        compiled = resolver.compile(css, properties=frozenset(properties))
+        assert compiled.resolve(inherited,
+                                typed=resolve == resolver.resolve_typed
+                                ) == expected
+
+
+def test_resolve_properties_skips_work():
+    diagnostics = Diagnostics()
+    resolver = CSS22Resolver(diagnostics=diagnostics, profile=True)
+    css = ('margin: 1 2 3 4 5; padding: 1em 2em; border: thin solid; '
+           'font-size: 2em; color: red')
+    assert resolver.resolve_string(css, properties={'color'}) == {
+        'color': 'red'}
+    assert not diagnostics
+    assert set(resolver.stats) == {'parse', 'font-size'}
+
+    # only the sides needed are converted
+    resolver.stats_clear()
+    out = resolver.resolve_typed('padding: 1em 2pt 3em 4em',
+                                 properties={'padding-right'})
+    assert out == {'padding-right': 2.}
+    assert resolver.stats['size'].calls == 1
+
+    # declarations skipped by the fast scanner do not shift positions
+    css = 'margin: 1px\n  2px;\ncolor: red;\n  border-top: solid'
+    keep = resolver._declaration_filter(frozenset(['border-top-style']))
+    assert (_describe_declarations(_scan_declarations(css, keep))
+            == _describe_declarations(_scan_declarations(css))[2:])
+
+    # expanders which do not declare their properties are always expanded
+    class MyResolver(CSS22Resolver):
+        pass
+
+    @MyResolver.register_expander('text-decoration')
+    def expand_text_decoration(resolver, prop, value):
+        yield 'text-decoration-line', value
+
+    out = MyResolver().resolve_string('text-decoration: underline',
+                                      properties={'text-decoration-line'})
+    assert out == {'text-decoration-line': 'underline'}
+
+    def expand_list_style(resolver, prop, value):
+        yield 'list-style-type', value
+
+    expand_list_style.expanded_properties = lambda sides: ['list-style-type']
+    MyResolver.register_expander('list-style', expand_list_style)
+    resolver = MyResolver(profile=True)
+    out = resolver.resolve_string(
+        'list-style: square; text-decoration: underline',
+        properties={'text-decoration-line'})
+    assert out == {'text-decoration-line': 'underline'}
+    assert 'expand:text-decoration' in resolver.stats
+    assert 'expand:list-style' not in resolver.stats
+
+
+def test_resolve_properties_batch(tmpdir):
+    items = ['font-size: %dpt; margin: 1em; color: red' % i
+             for i in range(10)]
+    properties = {'margin-left', 'color'}
+    expected = [{'margin-left': '%dpt' % i, 'color': 'red'}
+                for i in range(10)]
+    for resolver in [CSS22Resolver(cache_size=10),
+                     CSS22Resolver(cache_path=str(tmpdir.join('cache.db')))]:
+        assert resolver.resolve_string(items[2])['font-size'] == '2pt'
+        assert resolver.resolve_many(items, properties=properties) == expected
+        assert resolver.resolve_string(items[2])['font-size'] == '2pt'
+        assert list(resolver.resolve_iter(items, properties=properties)) == (
+            expected)
+    ids, registry = resolver.resolve_ids(items, properties=properties)
+    assert list(registry) == expected
+    for n_jobs, backend in [(2, 'thread'), (2, 'process')]:
+        assert resolver.resolve_many(items, n_jobs=n_jobs, backend=backend,
+                                     properties=properties) == expected
+    out, _ = _run_async(resolver.aresolve_many, items, None, False, 3, None,
+                        properties)
+    assert out == expected